@@ -16,6 +16,8 @@ from handlers import common # Общие команды (start, cancel)
 from handlers.channels import ADDING_CHANNEL_LINK
 from handlers import navigation # Обработчики навигации по меню
 from handlers import feeds, channels, subscriptions, force_check, pagination # Обработчики конкретных действий
+from rss_parser import close_http_client, shutdown_parse_executor
+from scheduler import start_scheduler, stop_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,13 @@ async def post_init(application: Application):
         BotCommand("cancel", "Отменить текущее действие"),
     ])
     logger.info("Команды бота установлены.")
+    start_scheduler(application)
+
+async def post_shutdown(application: Application):
+    """Выполняется при остановке приложения: освобождает общие ресурсы."""
+    stop_scheduler()
+    await close_http_client()
+    shutdown_parse_executor()
 
 def setup_application() -> Application | None:
     """Создает и настраивает объект Application."""
@@ -36,7 +45,7 @@ def setup_application() -> Application | None:
         logger.error("Токен Telegram бота не установлен в переменных окружения (TELEGRAM_BOT_TOKEN).")
         return None
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
 
     # --- Определяем ConversationHandlers для каждой фичи ---
 
@@ -62,12 +71,13 @@ def setup_application() -> Application | None:
         persistent=False # Не сохраняем состояние между перезапусками
     )
 
-    # 2. Управление лентой (удаление, задержка)
+    # 2. Управление лентой (удаление, задержка, интервал проверки)
     feed_manage_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(feeds.feed_action_handler, pattern="^(delete_feed_confirm_|set_delay_start_)")],
+        entry_points=[CallbackQueryHandler(feeds.feed_action_handler, pattern="^(delete_feed_confirm_|set_delay_start_|set_interval_start_)")],
         states={
             DELETE_FEED_CONFIRM: [CallbackQueryHandler(feeds.delete_feed_confirm_handler, pattern="^(delete_feed_do_|list_feeds_refresh$)")],
             SET_DELAY_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, feeds.set_delay_value_handler)],
+            SET_INTERVAL_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, feeds.set_interval_value_handler)],
         },
         fallbacks=[
             CommandHandler("cancel", common.cancel_conversation), # Используем правильное имя
@@ -166,6 +176,7 @@ def setup_application() -> Application | None:
         states={
             LIST_SUBS_SELECT_CHANNEL: [
                 CallbackQueryHandler(subscriptions.list_subs_select_channel, pattern="^listsub_chan_"),
+                CallbackQueryHandler(subscriptions.toggle_digest_mode, pattern="^digest_toggle_"), # Режим дайджеста подписки
                 CallbackQueryHandler(pagination.handle_pagination, pattern="^page_listsub_chan_") # Пагинация каналов
             ]
         },
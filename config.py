@@ -33,6 +33,129 @@ if BOT_MODE == "private" and not ADMIN_USER_IDS:
      logger.warning("Бот в приватном режиме, но не указан ни один ADMIN_USER_IDS. Никто не сможет использовать бота.")
 
 
+def _get_int_env(name: str, default: int) -> int:
+    """Читает целочисленную переменную окружения, при ошибке возвращает значение по умолчанию."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}='{value}'. Используется {default}.")
+        return default
+
+
+def _get_float_env(name: str, default: float) -> float:
+    """Читает дробную переменную окружения, при ошибке возвращает значение по умолчанию."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}='{value}'. Используется {default}.")
+        return default
+
+
+def _get_bool_env(name: str, default: bool) -> bool:
+    """Читает логическую переменную окружения (true/false, 1/0, yes/no)."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    value = value.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    logger.warning(f"Некорректное значение {name}='{value}'. Используется {default}.")
+    return default
+
+
+# --- Загрузка RSS лент (HTTP) ---
+# Таймаут одного HTTP запроса к ленте (секунды)
+FEED_FETCH_TIMEOUT_SECONDS = _get_float_env("FEED_FETCH_TIMEOUT_SECONDS", 20.0)
+# Общий срок загрузки ленты целиком, включая медленную передачу тела (секунды)
+FEED_FETCH_DEADLINE_SECONDS = max(1.0, _get_float_env("FEED_FETCH_DEADLINE_SECONDS", 60.0))
+# Максимальный размер тела ленты после распаковки gzip/deflate (байты), большие ответы прерываются
+FEED_MAX_RESPONSE_BYTES = max(1024, _get_int_env("FEED_MAX_RESPONSE_BYTES", 10 * 1024 * 1024))
+# Размер пула соединений общего HTTP клиента
+FEED_HTTP_MAX_CONNECTIONS = _get_int_env("FEED_HTTP_MAX_CONNECTIONS", 50)
+FEED_HTTP_MAX_KEEPALIVE_CONNECTIONS = _get_int_env("FEED_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+# Сколько лент проверяется одновременно в задаче проверки
+FEED_CHECK_CONCURRENCY = max(1, _get_int_env("FEED_CHECK_CONCURRENCY", 10))
+# Максимум лент, выбираемых для проверки за один запуск задачи (остальные - в следующий запуск)
+FEED_CHECK_BATCH_SIZE = max(1, _get_int_env("FEED_CHECK_BATCH_SIZE", 500))
+# Вежливость к источникам: одновременных запросов к одному хосту и минимальный интервал между их началами (секунды)
+FEED_HOST_MAX_CONCURRENCY = max(1, _get_int_env("FEED_HOST_MAX_CONCURRENCY", 2))
+FEED_HOST_MIN_DELAY_SECONDS = max(0.0, _get_float_env("FEED_HOST_MIN_DELAY_SECONDS", 1.0))
+# Пауза для хоста после ответа 429/503 без Retry-After и верхняя граница паузы (секунды)
+FEED_HOST_BACKOFF_SECONDS = max(1.0, _get_float_env("FEED_HOST_BACKOFF_SECONDS", 60.0))
+FEED_HOST_MAX_BACKOFF_SECONDS = max(FEED_HOST_BACKOFF_SECONDS, _get_float_env("FEED_HOST_MAX_BACKOFF_SECONDS", 3600.0))
+# Число процессов для разбора больших лент (0 - разбирать в основном процессе)
+FEED_PARSE_PROCESSES = max(0, _get_int_env("FEED_PARSE_PROCESSES", min(4, os.cpu_count() or 1)))
+# Ленты меньше этого размера (байты) разбираются в основном процессе: передача в пул дороже самого разбора
+FEED_PARSE_PROCESS_MIN_BYTES = max(0, _get_int_env("FEED_PARSE_PROCESS_MIN_BYTES", 256 * 1024))
+# Инкрементальный разбор: после скольких известных записей подряд разбор ленты останавливается (0 - отключен)
+FEED_KNOWN_ENTRIES_TO_STOP = max(0, _get_int_env("FEED_KNOWN_ENTRIES_TO_STOP", 5))
+# Сколько последних обработанных GUID ленты загружается из БД для инкрементального разбора
+# (столько же хешей ленты хранится в кеше процесса)
+FEED_RECENT_GUIDS_LIMIT = max(1, _get_int_env("FEED_RECENT_GUIDS_LIMIT", 200))
+# Предохранитель инкрементального разбора: максимум записей, извлекаемых из ленты за одну проверку
+FEED_MAX_ENTRIES_PER_CHECK = max(1, _get_int_env("FEED_MAX_ENTRIES_PER_CHECK", 500))
+# Объем памяти (МБ) под кеш уже обработанных GUID (при переполнении вытесняются давно не проверявшиеся ленты)
+SEEN_GUID_CACHE_MAX_MB = max(1, _get_int_env("SEEN_GUID_CACHE_MAX_MB", 32))
+# Границы адаптивного интервала проверки ленты по умолчанию (минуты, пользователь может задать свои для ленты)
+FEED_MIN_CHECK_INTERVAL_MINUTES = max(1, _get_int_env("FEED_MIN_CHECK_INTERVAL_MINUTES", 5))
+FEED_MAX_CHECK_INTERVAL_MINUTES = max(FEED_MIN_CHECK_INTERVAL_MINUTES, _get_int_env("FEED_MAX_CHECK_INTERVAL_MINUTES", 720))
+# Вес последнего наблюдения в скользящей оценке частоты публикаций ленты (0..1)
+FEED_RATE_SMOOTHING = min(1.0, max(0.01, _get_float_env("FEED_RATE_SMOOTHING", 0.3)))
+# Circuit breaker: после стольких неудачных проверок подряд лента приостанавливается
+FEED_CIRCUIT_FAILURE_THRESHOLD = max(1, _get_int_env("FEED_CIRCUIT_FAILURE_THRESHOLD", 5))
+# Первая приостановка (минуты), каждая следующая неудача удваивает ее до FEED_CIRCUIT_MAX_OPEN_HOURS
+FEED_CIRCUIT_OPEN_MINUTES = max(1, _get_int_env("FEED_CIRCUIT_OPEN_MINUTES", 60))
+FEED_CIRCUIT_MAX_OPEN_HOURS = max(1, _get_int_env("FEED_CIRCUIT_MAX_OPEN_HOURS", 7 * 24))
+
+
+# --- Публикация отложенных постов ---
+# Сколько постов публикатор берет из очереди за один проход
+PUBLISH_BATCH_SIZE = max(1, _get_int_env("PUBLISH_BATCH_SIZE", 100))
+# Максимальное время сна публикатора без пробуждения (страховка, секунды)
+PUBLISHER_MAX_IDLE_SECONDS = max(1.0, _get_float_env("PUBLISHER_MAX_IDLE_SECONDS", 300.0))
+# Максимум постов, одновременно находящихся в очередях отправки
+PUBLISH_MAX_IN_FLIGHT = max(1, _get_int_env("PUBLISH_MAX_IN_FLIGHT", 1000))
+# Лимиты Telegram: всего сообщений в секунду и сообщений в минуту в один чат (с допустимым всплеском)
+TELEGRAM_GLOBAL_RATE_PER_SECOND = max(0.1, _get_float_env("TELEGRAM_GLOBAL_RATE_PER_SECOND", 25.0))
+TELEGRAM_CHAT_RATE_PER_MINUTE = max(0.1, _get_float_env("TELEGRAM_CHAT_RATE_PER_MINUTE", 20.0))
+TELEGRAM_CHAT_BURST = max(1, _get_int_env("TELEGRAM_CHAT_BURST", 3))
+# Повторы при временных ошибках отправки: число попыток и экспоненциальная задержка (секунды)
+PUBLISH_MAX_ATTEMPTS = max(1, _get_int_env("PUBLISH_MAX_ATTEMPTS", 5))
+PUBLISH_RETRY_BASE_SECONDS = max(1.0, _get_float_env("PUBLISH_RETRY_BASE_SECONDS", 30.0))
+PUBLISH_RETRY_MAX_SECONDS = max(1.0, _get_float_env("PUBLISH_RETRY_MAX_SECONDS", 3600.0))
+# Через сколько секунд пост, забранный на отправку другим (упавшим) публикатором, возвращается в очередь
+PUBLISH_CLAIM_TIMEOUT_SECONDS = max(60.0, _get_float_env("PUBLISH_CLAIM_TIMEOUT_SECONDS", 900.0))
+# Длинные посты: разбивать на несколько сообщений (не более PUBLISH_MAX_MESSAGE_PARTS) вместо обрезки
+PUBLISH_SPLIT_LONG_MESSAGES = _get_bool_env("PUBLISH_SPLIT_LONG_MESSAGES", False)
+PUBLISH_MAX_MESSAGE_PARTS = max(1, _get_int_env("PUBLISH_MAX_MESSAGE_PARTS", 3))
+# Окно дайджеста (минуты): посты подписок в режиме дайджеста копятся до конца окна и уходят одним сообщением
+DIGEST_WINDOW_MINUTES = max(1, _get_int_env("DIGEST_WINDOW_MINUTES", 60))
+
+
+# --- Обслуживание БД (очистка истории) ---
+# Как часто запускается задача обслуживания (часы)
+MAINTENANCE_INTERVAL_HOURS = max(1.0, _get_float_env("MAINTENANCE_INTERVAL_HOURS", 24.0))
+# Через сколько дней удаляются опубликованные и неудачные отложенные посты (0 - не удалять)
+SCHEDULED_POSTS_RETENTION_DAYS = max(0, _get_int_env("SCHEDULED_POSTS_RETENTION_DAYS", 30))
+# Через сколько дней удаляются GUID опубликованных постов (0 - не удалять).
+# Последние PUBLISHED_POSTS_KEEP_PER_FEED GUID каждой ленты хранятся всегда, чтобы посты,
+# еще присутствующие в ленте, не были опубликованы повторно
+PUBLISHED_POSTS_RETENTION_DAYS = max(0, _get_int_env("PUBLISHED_POSTS_RETENTION_DAYS", 90))
+PUBLISHED_POSTS_KEEP_PER_FEED = max(1, _get_int_env("PUBLISHED_POSTS_KEEP_PER_FEED", 500))
+# Сколько строк удаляется за одну транзакцию (маленькие пачки не блокируют БД надолго)
+MAINTENANCE_BATCH_SIZE = max(1, _get_int_env("MAINTENANCE_BATCH_SIZE", 1000))
+# Выполнять ли VACUUM (SQLite) после очистки. ANALYZE выполняется всегда
+MAINTENANCE_VACUUM = _get_bool_env("MAINTENANCE_VACUUM", False)
+
+
 # --- Прочие настройки ---
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 DEFAULT_FEED_UPDATE_INTERVAL_MINUTES = 60
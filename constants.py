@@ -9,8 +9,9 @@
  SUBSCRIBE_SELECT_FEED, SUBSCRIBE_SELECT_CHANNEL, SUBSCRIBE_GET_HASHTAGS,
  UNSUBSCRIBE_SELECT_CHANNEL, UNSUBSCRIBE_SELECT_FEED,
  LIST_SUBS_SELECT_CHANNEL,
- EDIT_HASHTAGS_SELECT_CHANNEL, EDIT_HASHTAGS_SELECT_FEED, EDIT_HASHTAGS_GET_VALUE
- ) = range(21) # Уменьшено количество состояний
+ EDIT_HASHTAGS_SELECT_CHANNEL, EDIT_HASHTAGS_SELECT_FEED, EDIT_HASHTAGS_GET_VALUE,
+ SET_INTERVAL_VALUE
+ ) = range(22) # Уменьшено количество состояний
 
 # Ключи для user_data / context.user_data
 FEED_URL, FEED_DELAY, FEED_ID = "feed_url", "feed_delay", "feed_id"
@@ -1,20 +1,28 @@
 # database.py
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey, UniqueConstraint, Text, BigInteger
+from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Boolean, ForeignKey, UniqueConstraint, Index, Text, BigInteger, LargeBinary, MetaData, Table, inspect, text, bindparam, insert, select, update, delete, or_
+from sqlalchemy.schema import AddConstraint
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from sqlalchemy.sql import func
 import os
-from datetime import datetime, timezone
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, urlunsplit
 
 # Импортируем настройки режима работы
-from config import BOT_MODE
+from config import BOT_MODE, DIGEST_WINDOW_MINUTES, FEED_MIN_CHECK_INTERVAL_MINUTES, FEED_MAX_CHECK_INTERVAL_MINUTES
 # Импортируем константы для языка по умолчанию
 from constants import DEFAULT_LANGUAGE, SUPPORTED_LANGUAGES
+from guid_cache import seen_guid_cache
+from guid_hash import GUID_HASH_SIZE, hash_guid, legacy_guid_hash
 
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///rss_bot.db")
+# Максимальное число параметров в одном IN (...) запросе (лимит SQLite на переменные - 999)
+GUID_QUERY_CHUNK_SIZE = 500
+# Сколько строк копируется за один запрос при миграции на хеши GUID
+GUID_MIGRATION_BATCH_SIZE = 1000
 
 Base = declarative_base()
 # Создаем engine на основе DATABASE_URL. SQLAlchemy сам определит диалект.
@@ -50,11 +58,34 @@ class RSSFeed(Base):
     last_checked = Column(DateTime(timezone=True), server_default=func.now())
     update_interval_minutes = Column(Integer, default=60, nullable=False)
     publish_delay_minutes = Column(Integer, default=0, nullable=False)
+    # Валидаторы для условных запросов (If-None-Match / If-Modified-Since) и хеш последнего тела ответа
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    # Время следующей проверки (NULL - проверить при ближайшем запуске задачи)
+    next_check_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    # Адаптивный интервал проверки: текущее значение (NULL - update_interval_minutes),
+    # границы, заданные пользователем (NULL - значения из конфигурации), и оценка частоты публикаций
+    check_interval_minutes = Column(Float, nullable=True)
+    min_check_interval_minutes = Column(Integer, nullable=True)
+    max_check_interval_minutes = Column(Integer, nullable=True)
+    posts_per_hour = Column(Float, nullable=True)
+    # Число неудачных проверок подряд (для отсрочки повторных попыток)
+    consecutive_failures = Column(Integer, default=0, server_default=text("0"), nullable=False)
+    # Circuit breaker: 'closed' - обычные проверки, 'open' - лента приостановлена до suspended_until,
+    # 'half_open' - идет пробная проверка после приостановки
+    circuit_state = Column(String(16), default='closed', server_default=text("'closed'"), nullable=False)
+    suspended_until = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String(500), nullable=True)
+    # Нормализованный URL (normalize_feed_url): строки разных пользователей с одним источником
+    # проверяются вместе, даже если их собственное время проверки еще не наступило
+    source_url = Column(String, nullable=True, index=True)
 
     owner = relationship("User", back_populates="feeds")
     channels = relationship("ChannelFeedLink", back_populates="feed", cascade="all, delete-orphan")
     posts = relationship("PublishedPost", back_populates="feed", cascade="all, delete-orphan")
     scheduled_posts = relationship("ScheduledPost", back_populates="feed", cascade="all, delete-orphan")
+    entries = relationship("PostEntry", back_populates="feed", cascade="all, delete-orphan")
 
     # Уникальность URL для каждого пользователя в public режиме
     __table_args__ = (UniqueConstraint('user_id', 'url', name='_user_feed_url_uc'),)
@@ -83,6 +114,8 @@ class ChannelFeedLink(Base):
     channel_id = Column(Integer, ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
     feed_id = Column(Integer, ForeignKey("rss_feeds.id", ondelete="CASCADE"), primary_key=True)
     hashtags = Column(String, nullable=True)
+    # Режим дайджеста: посты за окно DIGEST_WINDOW_MINUTES отправляются одним сообщением со списком ссылок
+    digest_mode = Column(Boolean, default=False, server_default=text("false"), nullable=False)
 
     owner = relationship("User", back_populates="subscriptions")
     channel = relationship("Channel", back_populates="feeds")
@@ -95,11 +128,27 @@ class PublishedPost(Base):
     __tablename__ = "published_posts"
     id = Column(Integer, primary_key=True, index=True)
     feed_id = Column(Integer, ForeignKey("rss_feeds.id", ondelete="CASCADE"), nullable=False)
-    post_guid = Column(String(512), index=True, nullable=False)
+    # 16-байтный BLAKE2b от полного GUID: компактный индекс и никаких коллизий из-за обрезки длинных GUID
+    guid_hash = Column(LargeBinary(GUID_HASH_SIZE), nullable=False)
     published_at = Column(DateTime(timezone=True), server_default=func.now())
 
     feed = relationship("RSSFeed", back_populates="posts")
-    __table_args__ = (UniqueConstraint('feed_id', 'post_guid', name='_feed_post_uc'),)
+    __table_args__ = (UniqueConstraint('feed_id', 'guid_hash', name='_feed_post_hash_uc'),)
+
+
+class PostEntry(Base):
+    """Содержимое поста ленты. Хранится один раз, сколько бы каналов ни было подписано на ленту."""
+    __tablename__ = "post_entries"
+    id = Column(Integer, primary_key=True, index=True)
+    feed_id = Column(Integer, ForeignKey("rss_feeds.id", ondelete="CASCADE"), nullable=False)
+    guid_hash = Column(LargeBinary(GUID_HASH_SIZE), nullable=False)
+    title = Column(String)
+    link = Column(String)
+    summary = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    feed = relationship("RSSFeed", back_populates="entries")
+    __table_args__ = (UniqueConstraint('feed_id', 'guid_hash', name='_feed_entry_uc'),)
 
 
 class ScheduledPost(Base):
@@ -110,33 +159,173 @@ class ScheduledPost(Base):
     user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)
     feed_id = Column(Integer, ForeignKey("rss_feeds.id", ondelete="CASCADE"), nullable=False)
     channel_id = Column(Integer, ForeignKey("channels.id", ondelete="CASCADE"), nullable=False)
+    # GUID хранится только для логов (обрезается до 512 символов), уникальность - по guid_hash
     post_guid = Column(String(512), nullable=False)
+    guid_hash = Column(LargeBinary(GUID_HASH_SIZE), nullable=False)
     scheduled_time = Column(DateTime(timezone=True), nullable=False, index=True)
     status = Column(String, default="pending", nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Содержимое поста в post_entries. Колонки post_* заполнены только у строк, добавленных до появления post_entries
+    entry_id = Column(Integer, ForeignKey("post_entries.id", ondelete="CASCADE"), nullable=True, index=True)
     post_title = Column(String)
     post_link = Column(String)
     post_summary = Column(Text)
     hashtags = Column(String, nullable=True)
+    # Пост подписки в режиме дайджеста (отправляется вместе с другими постами канала за то же окно)
+    digest = Column(Boolean, default=False, server_default=text("false"), nullable=False)
+    # Число неудачных попыток отправки (flood control, сетевые ошибки)
+    attempts = Column(Integer, default=0, server_default=text("0"), nullable=False)
+    # Кто и когда забрал пост на отправку (статус 'sending')
+    claimed_by = Column(String(64), nullable=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
 
     # Связи не обязательны, но могут быть полезны
     # owner = relationship("User") # Связь с User не нужна напрямую
     feed = relationship("RSSFeed", back_populates="scheduled_posts")
     channel = relationship("Channel", back_populates="scheduled_posts")
 
-    # Уникальность поста для канала и пользователя
-    __table_args__ = (UniqueConstraint('user_id', 'feed_id', 'channel_id', 'post_guid', name='_user_feed_channel_post_uc'),)
+    __table_args__ = (
+        # Уникальность поста для канала и пользователя
+        UniqueConstraint('user_id', 'feed_id', 'channel_id', 'guid_hash', name='_user_feed_channel_post_hash_uc'),
+        # Очередь: частичный индекс только по ожидающим постам (SQLite и PostgreSQL),
+        # поэтому выборка не замедляется по мере накопления опубликованных строк
+        Index(
+            'ix_scheduled_posts_status_time', 'status', 'scheduled_time',
+            sqlite_where=text("status = 'pending'"), postgresql_where=text("status = 'pending'")
+        ),
+    )
 
 
 def init_db():
     """Инициализирует базу данных, создавая все таблицы."""
     try:
         Base.metadata.create_all(bind=engine)
+        _migrate_schema()
         logger.info("Таблицы базы данных успешно созданы/проверены.")
     except Exception as e:
         logger.error(f"Ошибка при инициализации базы данных: {e}")
         raise
 
+def _migrate_schema():
+    """
+    Добавляет в уже существующие таблицы колонки и индексы, появившиеся в моделях позже.
+    create_all создает только отсутствующие таблицы, поэтому без этого старые БД не обновятся.
+    """
+    _migrate_guid_hashes()
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    ddl += f" DEFAULT {default.text if hasattr(default, 'text') else repr(str(default))}"
+                conn.execute(text(ddl))
+                logger.info(f"Миграция: в таблицу {table.name} добавлена колонка {column.name}.")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    _backfill_feed_source_urls()
+
+def _backfill_feed_source_urls():
+    """Заполняет source_url лент, добавленных до появления колонки."""
+    feeds = RSSFeed.__table__
+    update_statement = update(feeds).where(feeds.c.id == bindparam('feed_id')).values(source_url=bindparam('feed_source_url'))
+    with engine.begin() as conn:
+        while True:
+            rows = conn.execute(
+                select(feeds.c.id, feeds.c.url).where(feeds.c.source_url.is_(None)).limit(GUID_MIGRATION_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            conn.execute(update_statement, [{'feed_id': feed_id, 'feed_source_url': normalize_feed_url(url)} for feed_id, url in rows])
+            logger.info(f"Миграция: заполнен source_url для {len(rows)} лент.")
+
+# Таблицы, в которых уникальность поста перешла со строки post_guid на guid_hash:
+# имя таблицы -> (имя старого ограничения уникальности, удаляется ли колонка post_guid)
+_GUID_HASH_MIGRATIONS = {
+    'published_posts': ('_feed_post_uc', True),
+    'scheduled_posts': ('_user_feed_channel_post_uc', False),
+}
+
+def _migrate_guid_hashes():
+    """
+    Переводит старые таблицы постов на guid_hash: считает хеши для существующих строк
+    и заменяет ограничение уникальности по post_guid на ограничение по guid_hash.
+    Полный GUID для строк, обрезанных раньше до LEGACY_GUID_MAX_LENGTH символов, восстановить нельзя,
+    поэтому они хешируются в обрезанном виде, а проверки дубликатов дополнительно ищут
+    длинные GUID по такому хешу (см. legacy_guid_hash).
+    """
+    inspector = inspect(engine)
+    for table_name, (old_constraint, drop_guid) in _GUID_HASH_MIGRATIONS.items():
+        if not inspector.has_table(table_name):
+            continue
+        if 'guid_hash' in {column['name'] for column in inspector.get_columns(table_name)}:
+            continue
+        table = Base.metadata.tables[table_name]
+        logger.info(f"Миграция: перевод таблицы {table_name} на хеши GUID...")
+        if engine.dialect.name == 'sqlite':
+            # SQLite не умеет удалять ограничения, поэтому таблица пересоздается с копированием строк
+            _rebuild_table_with_guid_hash(table, [index['name'] for index in inspector.get_indexes(table_name)])
+        else:
+            _alter_table_with_guid_hash(table, old_constraint, drop_guid)
+        logger.info(f"Миграция: таблица {table_name} переведена на хеши GUID.")
+
+def _rebuild_table_with_guid_hash(table: Table, index_names: List[str]):
+    """Пересоздает таблицу по текущей модели и копирует в нее строки, вычисляя guid_hash."""
+    old_name = f"{table.name}_old"
+    with engine.begin() as conn:
+        # Имена индексов в SQLite глобальны, старые индексы мешают создать новые с теми же именами
+        for index_name in index_names:
+            conn.execute(text(f'DROP INDEX IF EXISTS "{index_name}"'))
+        conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+        table.create(bind=conn)
+        old_table = Table(old_name, MetaData(), autoload_with=conn)
+        columns = [column.name for column in old_table.columns if column.name in table.c]
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(old_table).where(old_table.c.id > last_id).order_by(old_table.c.id).limit(GUID_MIGRATION_BATCH_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            conn.execute(insert(table), [
+                {**{name: row[name] for name in columns}, 'guid_hash': hash_guid(row['post_guid'])} for row in rows
+            ])
+            last_id = rows[-1]['id']
+        conn.execute(text(f'DROP TABLE {old_name}'))
+
+def _alter_table_with_guid_hash(table: Table, old_constraint: str, drop_guid: bool):
+    """Добавляет guid_hash через ALTER TABLE, заполняет его пачками и меняет ограничение уникальности."""
+    column_type = table.c.guid_hash.type.compile(dialect=engine.dialect)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN guid_hash {column_type}"))
+        old_table = Table(table.name, MetaData(), autoload_with=conn)
+        update_statement = update(old_table).where(old_table.c.id == bindparam('row_id')).values(guid_hash=bindparam('row_hash'))
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(old_table.c.id, old_table.c.post_guid)
+                .where(old_table.c.id > last_id).order_by(old_table.c.id).limit(GUID_MIGRATION_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            conn.execute(update_statement, [{'row_id': row_id, 'row_hash': hash_guid(post_guid)} for row_id, post_guid in rows])
+            last_id = rows[-1][0]
+        conn.execute(text(f"ALTER TABLE {table.name} DROP CONSTRAINT {old_constraint}"))
+        if drop_guid:
+            conn.execute(text(f"ALTER TABLE {table.name} DROP COLUMN post_guid"))
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN guid_hash SET NOT NULL"))
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                conn.execute(AddConstraint(constraint))
+
 def get_db():
     """Генератор сессии базы данных."""
     db = SessionLocal()
@@ -229,6 +418,25 @@ def delete_channel(db_session, chat_id: str, user_id: Optional[int] = None):
     logger.warning(f"Канал {chat_id} не найден для пользователя {user_id or 'N/A'}.")
     return False
 
+def normalize_feed_url(feed_url: str) -> str:
+    """
+    Приводит URL ленты к каноническому виду для поиска одинаковых источников:
+    схема и хост в нижнем регистре, без порта по умолчанию и без фрагмента.
+    """
+    try:
+        parts = urlsplit(feed_url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return feed_url.strip()
+    netloc = host
+    if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        netloc = f"{host}:{port}"
+    if parts.username or parts.password:
+        netloc = f"{parts.netloc.rsplit('@', 1)[0]}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
 # Ленты
 def add_feed(db_session, url: str, name: str = None, update_interval_minutes: int = 60, publish_delay_minutes: int = 0, user_id: Optional[int] = None):
     """Добавляет новую RSS-ленту, привязывая к пользователю в public режиме."""
@@ -242,8 +450,9 @@ def add_feed(db_session, url: str, name: str = None, update_interval_minutes: in
         return existing_feed
 
     new_feed = RSSFeed(
-        url=url, name=name, update_interval_minutes=update_interval_minutes,
-        publish_delay_minutes=publish_delay_minutes, user_id=owner_id
+        url=url, source_url=normalize_feed_url(url), name=name, update_interval_minutes=update_interval_minutes,
+        publish_delay_minutes=publish_delay_minutes, user_id=owner_id,
+        next_check_at=datetime.now(timezone.utc) + timedelta(minutes=update_interval_minutes)
     )
     db_session.add(new_feed)
     db_session.commit()
@@ -268,11 +477,100 @@ def get_all_feeds(db_session, user_id: Optional[int] = None):
     if owner_id: query = query.filter(RSSFeed.user_id == owner_id)
     return query.all()
 
-# update_feed_last_checked не зависит от пользователя, т.к. проверка глобальна
-def update_feed_last_checked(db_session, feed_id: int):
+def get_due_feeds(db_session, now: datetime, limit: int) -> List[RSSFeed]:
+    """Возвращает ленты, время проверки которых наступило, начиная с самых просроченных (по индексу next_check_at)."""
+    return db_session.query(RSSFeed).filter(
+        or_(RSSFeed.next_check_at.is_(None), RSSFeed.next_check_at <= now)
+    ).order_by(RSSFeed.next_check_at.asc().nullsfirst()).limit(limit).all()
+
+def get_feeds_by_source_urls(db_session, source_urls: Iterable[str], exclude_ids: Iterable[int] = ()) -> List[RSSFeed]:
+    """
+    Возвращает ленты с указанными нормализованными URL, кроме exclude_ids (например, ленты других
+    пользователей с тем же источником, время проверки которых еще не наступило).
+    """
+    source_urls = list(source_urls)
+    exclude_ids = set(exclude_ids)
+    feeds = []
+    for i in range(0, len(source_urls), GUID_QUERY_CHUNK_SIZE):
+        chunk = source_urls[i:i + GUID_QUERY_CHUNK_SIZE]
+        feeds.extend(
+            feed for feed in db_session.query(RSSFeed).filter(RSSFeed.source_url.in_(chunk)).all()
+            if feed.id not in exclude_ids
+        )
+    return feeds
+
+def get_feed_check_bounds(feed: RSSFeed) -> Tuple[int, int]:
+    """Возвращает (минимальный, максимальный) интервал проверки ленты в минутах."""
+    min_minutes = feed.min_check_interval_minutes or FEED_MIN_CHECK_INTERVAL_MINUTES
+    max_minutes = feed.max_check_interval_minutes or FEED_MAX_CHECK_INTERVAL_MINUTES
+    return min_minutes, max(min_minutes, max_minutes)
+
+def get_feed_check_interval(feed: RSSFeed) -> float:
+    """Текущий (адаптивный) интервал проверки ленты в минутах в пределах ее границ."""
+    min_minutes, max_minutes = get_feed_check_bounds(feed)
+    return min(max_minutes, max(min_minutes, feed.check_interval_minutes or feed.update_interval_minutes))
+
+# update_feed_check_schedule не зависит от пользователя, т.к. проверка глобальна
+def update_feed_check_schedule(db_session, feed_id: int, check_interval_minutes: float, next_check_in_minutes: float,
+                               posts_per_hour: Optional[float], consecutive_failures: int,
+                               circuit_state: str = 'closed', last_error: Optional[str] = None):
+    """
+    Сохраняет результат проверки ленты: время проверки, новый интервал, оценку частоты,
+    состояние circuit breaker и время следующей проверки (для 'open' оно же - конец приостановки).
+    """
     feed = db_session.query(RSSFeed).filter(RSSFeed.id == feed_id).first() # Получаем без фильтра по user_id
     if feed:
-        feed.last_checked = datetime.now(timezone.utc)
+        now = datetime.now(timezone.utc)
+        feed.last_checked = now
+        feed.check_interval_minutes = check_interval_minutes
+        feed.posts_per_hour = posts_per_hour
+        feed.consecutive_failures = consecutive_failures
+        feed.next_check_at = now + timedelta(minutes=next_check_in_minutes)
+        feed.circuit_state = circuit_state
+        feed.suspended_until = feed.next_check_at if circuit_state == 'open' else None
+        feed.last_error = last_error
+        db_session.commit()
+
+def mark_feeds_half_open(db_session, feed_ids: List[int]) -> int:
+    """Переводит приостановленные ленты, выбранные для проверки, в состояние пробной проверки (с commit)."""
+    if not feed_ids:
+        return 0
+    result = db_session.execute(
+        update(RSSFeed)
+        .where(RSSFeed.id.in_(feed_ids), RSSFeed.circuit_state == 'open')
+        .values(circuit_state='half_open')
+    )
+    db_session.commit()
+    return result.rowcount
+
+def update_feed_check_bounds(db_session, feed_id: int, min_minutes: int, max_minutes: int, user_id: Optional[int] = None) -> bool:
+    """Задает границы адаптивного интервала проверки ленты, проверяя владельца в public режиме."""
+    feed = get_feed(db_session, feed_id=feed_id, user_id=user_id)
+    if not feed:
+        logger.warning(f"Лента ID {feed_id} не найдена для пользователя {user_id or 'N/A'}.")
+        return False
+    feed.min_check_interval_minutes = min_minutes
+    feed.max_check_interval_minutes = max_minutes
+    feed.check_interval_minutes = get_feed_check_interval(feed)
+    # Следующая проверка не должна откладываться дальше новой верхней границы
+    latest_check_at = datetime.now(timezone.utc) + timedelta(minutes=max_minutes)
+    next_check_at = feed.next_check_at
+    if next_check_at is not None and next_check_at.tzinfo is None:
+        next_check_at = next_check_at.replace(tzinfo=timezone.utc)
+    # Приостановку circuit breaker новые границы не сокращают
+    if feed.circuit_state == 'closed' and next_check_at is not None and next_check_at > latest_check_at:
+        feed.next_check_at = latest_check_at
+    db_session.commit()
+    logger.info(f"Интервал проверки ленты ID {feed_id} (User: {user_id or 'N/A'}) ограничен {min_minutes}-{max_minutes} мин.")
+    return True
+
+def update_feed_validators(db_session, feed_id: int, etag: Optional[str], last_modified: Optional[str], content_hash: Optional[str]):
+    """Сохраняет ETag, Last-Modified и хеш содержимого ленты для следующего условного запроса."""
+    feed = db_session.query(RSSFeed).filter(RSSFeed.id == feed_id).first()
+    if feed:
+        feed.etag = etag
+        feed.last_modified = last_modified
+        feed.content_hash = content_hash
         db_session.commit()
 
 def update_feed_delay(db_session, feed_id: int, delay_minutes: int, user_id: Optional[int] = None):
@@ -293,6 +591,7 @@ def delete_feed(db_session, feed_id: int, user_id: Optional[int] = None):
         url_deleted = feed.url
         db_session.delete(feed)
         db_session.commit()
+        seen_guid_cache.discard(feed_id)
         logger.info(f"Лента ID {feed_id} ({url_deleted}) удалена для пользователя {user_id or 'N/A'}.")
         return True
     logger.warning(f"Лента ID {feed_id} не найдена для пользователя {user_id or 'N/A'}.")
@@ -349,6 +648,15 @@ def get_subscription(db_session, channel_id: int, feed_id: int, user_id: Optiona
     if owner_id: query = query.filter(ChannelFeedLink.user_id == owner_id)
     return query.first()
 
+def update_subscription_digest_mode(db_session, channel_id: int, feed_id: int, digest_mode: bool, user_id: Optional[int] = None) -> bool:
+    """Включает или выключает режим дайджеста подписки, проверяя владельца в public режиме."""
+    link = get_subscription(db_session, channel_id=channel_id, feed_id=feed_id, user_id=user_id)
+    if not link: return False
+    link.digest_mode = digest_mode
+    db_session.commit()
+    logger.info(f"Режим дайджеста для подписки канала ID {channel_id} на ленту ID {feed_id} (User: {user_id or 'N/A'}) {'включен' if digest_mode else 'выключен'}.")
+    return True
+
 def update_subscription_hashtags(db_session, channel_id: int, feed_id: int, hashtags: str | None, user_id: Optional[int] = None):
     """Обновляет хештеги, проверяя владельца в public режиме."""
     link = get_subscription(db_session, channel_id=channel_id, feed_id=feed_id, user_id=user_id)
@@ -388,46 +696,236 @@ def get_subscriptions_for_feed(db_session, feed_id: int) -> List[ChannelFeedLink
 
 # Опубликованные посты (не зависят от пользователя)
 def add_published_post(db_session, feed_id: int, post_guid: str):
-    if len(post_guid) > 512: post_guid = post_guid[:512]
     if is_post_published(db_session, feed_id, post_guid): return None
-    new_post = PublishedPost(feed_id=feed_id, post_guid=post_guid)
+    new_post = PublishedPost(feed_id=feed_id, guid_hash=hash_guid(post_guid))
     db_session.add(new_post)
     logger.info(f"Запись об обработке поста {post_guid} для ленты {feed_id} добавлена.")
     return new_post
 
 def is_post_published(db_session, feed_id: int, post_guid: str) -> bool:
-    if len(post_guid) > 512: post_guid = post_guid[:512]
-    return db_session.query(PublishedPost).filter_by(feed_id=feed_id, post_guid=post_guid).count() > 0
+    hashes = [hash_guid(post_guid)]
+    legacy_hash = legacy_guid_hash(post_guid)
+    if legacy_hash is not None:
+        hashes.append(legacy_hash)
+    return db_session.query(PublishedPost).filter(
+        PublishedPost.feed_id == feed_id, PublishedPost.guid_hash.in_(hashes)
+    ).count() > 0
+
+def get_published_guids(db_session, feed_id: int, post_guids: Iterable[str]) -> Set[str]:
+    """
+    Возвращает подмножество переданных GUID, уже отмеченных как обработанные для ленты.
+    Выполняет один запрос IN (...) по хешам на каждые GUID_QUERY_CHUNK_SIZE значений.
+    Длинные GUID ищутся и по хешу обрезанной строки, под которым их сохранили старые версии.
+    """
+    guids_by_hash = {}
+    for guid in post_guids:
+        guids_by_hash.setdefault(hash_guid(guid), []).append(guid)
+        legacy_hash = legacy_guid_hash(guid)
+        if legacy_hash is not None:
+            guids_by_hash.setdefault(legacy_hash, []).append(guid)
+    hashes = list(guids_by_hash)
+    published = set()
+    for i in range(0, len(hashes), GUID_QUERY_CHUNK_SIZE):
+        chunk = hashes[i:i + GUID_QUERY_CHUNK_SIZE]
+        rows = db_session.query(PublishedPost.guid_hash).filter(
+            PublishedPost.feed_id == feed_id,
+            PublishedPost.guid_hash.in_(chunk)
+        ).all()
+        for (guid_hash,) in rows:
+            published.update(guids_by_hash.get(bytes(guid_hash), ()))
+    return published
+
+def get_recent_guid_hashes(db_session, feed_id: int, limit: int) -> Set[bytes]:
+    """Возвращает хеши GUID последних limit обработанных постов ленты (для инкрементального разбора)."""
+    rows = db_session.query(PublishedPost.guid_hash).filter(
+        PublishedPost.feed_id == feed_id
+    ).order_by(PublishedPost.id.desc()).limit(limit).all()
+    return {bytes(guid_hash) for (guid_hash,) in rows}
+
+def add_published_posts(db_session, feed_id: int, post_guids: Iterable[str]) -> int:
+    """
+    Отмечает GUID как обработанные одной пакетной вставкой (без commit).
+    Вызывающий код должен заранее отфильтровать уже известные GUID через get_published_guids.
+    """
+    keys = list(dict.fromkeys(hash_guid(guid) for guid in post_guids))
+    if not keys:
+        return 0
+    db_session.execute(insert(PublishedPost), [{'feed_id': feed_id, 'guid_hash': key} for key in keys])
+    logger.info(f"Добавлено {len(keys)} записей об обработке постов для ленты {feed_id}.")
+    return len(keys)
 
 # Отложенные посты
 def add_scheduled_post(db_session, feed_id: int, channel_id: int, post_guid: str, scheduled_time: datetime, post_data: dict, hashtags: str | None = None, user_id: Optional[int] = None):
     """Добавляет пост в очередь, привязывая к пользователю в public режиме."""
     owner_id = user_id if BOT_MODE == 'public' else None
-    query = db_session.query(ScheduledPost).filter_by(feed_id=feed_id, channel_id=channel_id, post_guid=post_guid)
+    guid_hash = hash_guid(post_guid)
+    query = db_session.query(ScheduledPost).filter_by(feed_id=feed_id, channel_id=channel_id, guid_hash=guid_hash)
     if owner_id: query = query.filter(ScheduledPost.user_id == owner_id)
     existing = query.first()
 
     if existing:
         logger.warning(f"Пост {post_guid} для канала ID {channel_id} (User: {owner_id or 'N/A'}) уже в очереди.")
         return None
-    if len(post_guid) > 512: post_guid = post_guid[:512]
+    entry_ids = add_post_entries(db_session, feed_id, [dict(post_data, guid=post_guid)])
     new_scheduled_post = ScheduledPost(
-        user_id=owner_id, feed_id=feed_id, channel_id=channel_id, post_guid=post_guid,
-        scheduled_time=scheduled_time, post_title=post_data.get('title'),
-        post_link=post_data.get('link'), post_summary=post_data.get('summary'),
+        user_id=owner_id, feed_id=feed_id, channel_id=channel_id, post_guid=post_guid[:512], guid_hash=guid_hash,
+        entry_id=entry_ids.get(guid_hash), scheduled_time=scheduled_time,
         hashtags=hashtags, status="pending"
     )
     db_session.add(new_scheduled_post)
     logger.info(f"Пост {post_guid} добавлен в очередь для канала ID {channel_id} (User: {owner_id or 'N/A'}) на {scheduled_time.strftime('%Y-%m-%d %H:%M:%S %Z')}.")
     return new_scheduled_post
 
+def _insert_ignoring_duplicates(db_session, model, rows: List[dict]):
+    """Пакетная вставка, при которой строки, нарушающие уникальность, пропускаются (ON CONFLICT DO NOTHING)."""
+    dialect_name = db_session.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    if dialect_insert is not None:
+        statement = dialect_insert(model).on_conflict_do_nothing()
+    else:
+        statement = insert(model)
+    db_session.execute(statement, rows)
+
+def add_post_entries(db_session, feed_id: int, posts: List[dict]) -> Dict[bytes, int]:
+    """
+    Сохраняет содержимое постов в post_entries (уже сохраненные пропускаются) и
+    возвращает словарь guid_hash -> id записи. Без commit.
+    """
+    rows = {}
+    for post_data in posts:
+        guid_hash = hash_guid(post_data['guid'])
+        rows.setdefault(guid_hash, {
+            'feed_id': feed_id, 'guid_hash': guid_hash, 'title': post_data.get('title'),
+            'link': post_data.get('link'), 'summary': post_data.get('summary')
+        })
+    if not rows:
+        return {}
+    _insert_ignoring_duplicates(db_session, PostEntry, list(rows.values()))
+
+    entry_ids = {}
+    hashes = list(rows)
+    for i in range(0, len(hashes), GUID_QUERY_CHUNK_SIZE):
+        chunk = hashes[i:i + GUID_QUERY_CHUNK_SIZE]
+        for entry_id, guid_hash in db_session.query(PostEntry.id, PostEntry.guid_hash).filter(
+            PostEntry.feed_id == feed_id, PostEntry.guid_hash.in_(chunk)
+        ):
+            entry_ids[bytes(guid_hash)] = entry_id
+    return entry_ids
+
+def get_digest_time(scheduled_time: datetime) -> datetime:
+    """
+    Возвращает конец окна дайджеста, в которое попадает scheduled_time: все посты канала
+    за одно окно получают одинаковое время и забираются публикатором вместе.
+    """
+    window = timedelta(minutes=DIGEST_WINDOW_MINUTES)
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    if scheduled_time.tzinfo is None:
+        scheduled_time = scheduled_time.replace(tzinfo=timezone.utc)
+    windows_passed = -((epoch - scheduled_time) // window) # Округление вверх
+    return epoch + windows_passed * window
+
+def add_scheduled_posts(db_session, feed_id: int, scheduled_time: datetime, posts: List[dict], subscriptions: List[ChannelFeedLink]) -> int:
+    """
+    Добавляет в очередь все пары (пост x подписка) одной пакетной вставкой (без commit).
+    Содержимое поста сохраняется один раз в post_entries, строки очереди ссылаются на него по entry_id.
+    Дубликаты отбрасываются базой по _user_feed_channel_post_hash_uc (INSERT ... ON CONFLICT DO NOTHING),
+    без предварительного SELECT на каждую строку. Возвращает число подготовленных строк.
+    """
+    if not posts or not subscriptions:
+        return 0
+    entry_ids = add_post_entries(db_session, feed_id, posts)
+    digest_time = get_digest_time(scheduled_time)
+    rows = []
+    for post_data in posts:
+        post_guid = post_data['guid'][:512]
+        guid_hash = hash_guid(post_data['guid'])
+        for sub in subscriptions:
+            rows.append({
+                'user_id': sub.user_id if BOT_MODE == 'public' else None,
+                'feed_id': feed_id, 'channel_id': sub.channel_id, 'post_guid': post_guid, 'guid_hash': guid_hash,
+                'entry_id': entry_ids.get(guid_hash),
+                'scheduled_time': digest_time if sub.digest_mode else scheduled_time,
+                'hashtags': sub.hashtags, 'digest': bool(sub.digest_mode), 'status': "pending"
+            })
+
+    _insert_ignoring_duplicates(db_session, ScheduledPost, rows)
+    logger.info(f"Подготовлено {len(rows)} постов в очередь для ленты {feed_id} на {scheduled_time.strftime('%Y-%m-%d %H:%M:%S %Z')}.")
+    return len(rows)
+
 def get_pending_scheduled_posts(db_session, limit=100):
     """Получает посты, готовые к публикации (не зависит от пользователя)."""
     now = datetime.now(timezone.utc)
     return db_session.query(ScheduledPost).filter(
         ScheduledPost.status == "pending",
         ScheduledPost.scheduled_time <= now
-    ).order_by(ScheduledPost.scheduled_time).limit(limit).all()
+    ).order_by(ScheduledPost.scheduled_time, ScheduledPost.id).limit(limit).all()
+
+def claim_due_scheduled_posts(db_session, worker_id: str, limit: int = 100) -> List[ScheduledPost]:
+    """
+    Атомарно забирает готовые к публикации посты на отправку (status -> 'sending') и возвращает их.
+    На PostgreSQL строки выбираются с FOR UPDATE SKIP LOCKED, поэтому несколько публикаторов
+    не заберут один и тот же пост; в SQLite запись и так сериализована.
+    """
+    now = datetime.now(timezone.utc)
+    due_ids = select(ScheduledPost.id).where(
+        ScheduledPost.status == "pending",
+        ScheduledPost.scheduled_time <= now
+    ).order_by(ScheduledPost.scheduled_time, ScheduledPost.id).limit(limit)
+    if db_session.get_bind().dialect.name == 'postgresql':
+        due_ids = due_ids.with_for_update(skip_locked=True)
+
+    claimed = db_session.execute(
+        update(ScheduledPost)
+        .where(ScheduledPost.id.in_(due_ids), ScheduledPost.status == "pending")
+        .values(status="sending", claimed_by=worker_id, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db_session.commit()
+    if not claimed:
+        return []
+    return db_session.query(ScheduledPost).filter(
+        ScheduledPost.status == "sending",
+        ScheduledPost.claimed_by == worker_id,
+        ScheduledPost.claimed_at == now
+    ).order_by(ScheduledPost.scheduled_time, ScheduledPost.id).all()
+
+def release_scheduled_post_claims(db_session, post_ids: Optional[List[int]] = None, claimed_by: Optional[str] = None,
+                                  claimed_before: Optional[datetime] = None, exclude_claimed_by: Optional[str] = None) -> int:
+    """
+    Возвращает забранные на отправку посты в очередь (status 'sending' -> 'pending').
+    Фильтры: конкретные ID (остановка воркера), публикатор claimed_by (перезапуск процесса)
+    или граница claimed_at для чужих публикаторов (зависший или упавший процесс). Без commit.
+    """
+    query = db_session.query(ScheduledPost).filter(ScheduledPost.status == "sending")
+    if post_ids is not None:
+        if not post_ids:
+            return 0
+        query = query.filter(ScheduledPost.id.in_(post_ids))
+    if claimed_by is not None:
+        query = query.filter(ScheduledPost.claimed_by == claimed_by)
+    if claimed_before is not None:
+        query = query.filter(ScheduledPost.claimed_at < claimed_before)
+    if exclude_claimed_by is not None:
+        query = query.filter(or_(ScheduledPost.claimed_by.is_(None), ScheduledPost.claimed_by != exclude_claimed_by))
+    released = query.update(
+        {ScheduledPost.status: "pending", ScheduledPost.claimed_by: None, ScheduledPost.claimed_at: None},
+        synchronize_session=False
+    )
+    if released:
+        logger.info(f"Возвращено в очередь {released} забранных на отправку постов.")
+    return released
+
+def get_next_scheduled_time(db_session) -> Optional[datetime]:
+    """Возвращает время ближайшего ожидающего публикации поста или None, если очередь пуста."""
+    return db_session.query(func.min(ScheduledPost.scheduled_time)).filter(
+        ScheduledPost.status == "pending"
+    ).scalar()
 
 def update_scheduled_post_status(db_session, post_id: int, status: str):
     """Обновляет статус отложенного поста."""
@@ -439,6 +937,20 @@ def update_scheduled_post_status(db_session, post_id: int, status: str):
     logger.warning(f"Не найден отложенный пост ID {post_id} для обновления статуса.")
     return False
 
+def reschedule_scheduled_post(db_session, post_id: int, scheduled_time: datetime):
+    """Возвращает пост в очередь на новое время после временной ошибки и увеличивает счетчик неудачных попыток."""
+    post = db_session.query(ScheduledPost).filter(ScheduledPost.id == post_id).first()
+    if post:
+        post.status = "pending"
+        post.scheduled_time = scheduled_time
+        post.attempts = (post.attempts or 0) + 1
+        post.claimed_by = None
+        post.claimed_at = None
+        logger.info(f"Отложенный пост ID {post_id} перенесен на {scheduled_time.strftime('%Y-%m-%d %H:%M:%S %Z')} (попытка {post.attempts}).")
+        return True
+    logger.warning(f"Не найден отложенный пост ID {post_id} для переноса.")
+    return False
+
 def delete_scheduled_post(db_session, post_id: int):
     """Удаляет отложенный пост."""
     post = db_session.query(ScheduledPost).filter(ScheduledPost.id == post_id).first()
@@ -448,6 +960,85 @@ def delete_scheduled_post(db_session, post_id: int):
         return True
     return False
 
+# Обслуживание (очистка истории)
+def delete_old_scheduled_posts(db_session, older_than: datetime, limit: int) -> int:
+    """Удаляет пачку опубликованных и неудачных отложенных постов со временем публикации раньше older_than (без commit)."""
+    post_ids = db_session.execute(
+        select(ScheduledPost.id)
+        .where(ScheduledPost.status.in_(("published", "failed")), ScheduledPost.scheduled_time < older_than)
+        .limit(limit)
+    ).scalars().all()
+    if not post_ids:
+        return 0
+    db_session.execute(delete(ScheduledPost).where(ScheduledPost.id.in_(post_ids)))
+    return len(post_ids)
+
+def delete_old_published_posts(db_session, older_than: datetime, keep_latest: int, limit: int) -> int:
+    """
+    Удаляет пачку записей об обработанных постах старше older_than сразу по всем лентам (без commit).
+    Последние keep_latest записей каждой ленты не удаляются независимо от возраста: их GUID могут
+    еще присутствовать в ленте, и без записи пост был бы опубликован повторно.
+    Номер записи в ленте считается оконной функцией, и только для лент, где записей больше keep_latest.
+    """
+    over_limit_feeds = select(PublishedPost.feed_id).group_by(PublishedPost.feed_id).having(func.count() > keep_latest)
+    ranked = select(
+        PublishedPost.id, PublishedPost.published_at,
+        func.row_number().over(partition_by=PublishedPost.feed_id, order_by=PublishedPost.id.desc()).label('position')
+    ).where(PublishedPost.feed_id.in_(over_limit_feeds)).subquery()
+    post_ids = db_session.execute(
+        select(ranked.c.id).where(ranked.c.position > keep_latest, ranked.c.published_at < older_than).limit(limit)
+    ).scalars().all()
+    if not post_ids:
+        return 0
+    db_session.execute(delete(PublishedPost).where(PublishedPost.id.in_(post_ids)))
+    return len(post_ids)
+
+def delete_orphaned_posts(db_session, limit: int) -> int:
+    """
+    Удаляет пачку записей, оставшихся от удаленных лент и каналов, и содержимое постов,
+    которые удалены из очереди (без commit).
+    SQLite без PRAGMA foreign_keys не выполняет ON DELETE CASCADE, и такие строки копятся.
+    """
+    deleted = 0
+    scheduled_ids = db_session.execute(
+        select(ScheduledPost.id).where(or_(
+            ScheduledPost.feed_id.not_in(select(RSSFeed.id)),
+            ScheduledPost.channel_id.not_in(select(Channel.id))
+        )).limit(limit)
+    ).scalars().all()
+    if scheduled_ids:
+        db_session.execute(delete(ScheduledPost).where(ScheduledPost.id.in_(scheduled_ids)))
+        deleted += len(scheduled_ids)
+    published_ids = db_session.execute(
+        select(PublishedPost.id).where(PublishedPost.feed_id.not_in(select(RSSFeed.id))).limit(limit)
+    ).scalars().all()
+    if published_ids:
+        db_session.execute(delete(PublishedPost).where(PublishedPost.id.in_(published_ids)))
+        deleted += len(published_ids)
+    # Содержимое постов, на которое больше не ссылается ни одна строка очереди
+    entry_ids = db_session.execute(
+        select(PostEntry.id).where(
+            ~select(ScheduledPost.id).where(ScheduledPost.entry_id == PostEntry.id).exists()
+        ).limit(limit)
+    ).scalars().all()
+    if entry_ids:
+        db_session.execute(delete(PostEntry).where(PostEntry.id.in_(entry_ids)))
+        deleted += len(entry_ids)
+    return deleted
+
+def compact_database(vacuum: bool = False):
+    """
+    Обновляет статистику планировщика запросов (ANALYZE) и, если vacuum=True, возвращает
+    свободное место ОС (VACUUM). Выполняется вне транзакции и может занять долгое время,
+    поэтому вызывается из отдельного потока.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if vacuum:
+            conn.execute(text("VACUUM"))
+            logger.info("VACUUM базы данных выполнен.")
+        conn.execute(text("ANALYZE"))
+        logger.info("ANALYZE базы данных выполнен.")
+
 def format_hashtags(hashtags: Optional[str]) -> Optional[str]:
     """Вспомогательная функция для форматирования хештегов."""
     if not hashtags:
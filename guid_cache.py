@@ -0,0 +1,92 @@
+# guid_cache.py
+import logging
+from collections import OrderedDict
+from typing import Iterable, Optional, Set
+
+from config import FEED_RECENT_GUIDS_LIMIT, SEEN_GUID_CACHE_MAX_MB
+
+logger = logging.getLogger(__name__)
+
+# Примерный расход памяти на один хеш GUID в кеше: объект bytes (16 байт данных) и запись в словаре
+_ENTRY_SIZE_BYTES = 128
+
+
+class SeenGuidCache:
+    """
+    Кеш хешей уже обработанных GUID по лентам, чтобы не спрашивать БД о постах,
+    которые процесс видел на прошлых проверках. У каждой ленты хранятся не больше max_entries_per_feed
+    последних хешей, чтобы стоимость проверки активной ленты не росла со временем. Общий размер
+    ограничен max_entries: при переполнении вытесняются ленты, к которым дольше всего не обращались (LRU).
+    Кеш хранит только подмножество published_posts, поэтому промах не означает, что пост новый.
+    """
+
+    def __init__(self, max_entries: int, max_entries_per_feed: int):
+        self.max_entries = max(1, max_entries)
+        self.max_entries_per_feed = max(1, max_entries_per_feed)
+        # feed_id -> хеши GUID в порядке добавления; порядок лент - от давно использованных к недавним
+        self._feeds: "OrderedDict[int, OrderedDict[bytes, None]]" = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get(self, feed_id: int) -> Optional[Set[bytes]]:
+        """Возвращает хеши GUID ленты или None, если лента еще не загружена в кеш."""
+        feed_hashes = self._feeds.get(feed_id)
+        if feed_hashes is None:
+            return None
+        self._feeds.move_to_end(feed_id)
+        return set(feed_hashes)
+
+    def contains(self, feed_id: int, guid_hash: bytes) -> bool:
+        feed_hashes = self._feeds.get(feed_id)
+        return feed_hashes is not None and guid_hash in feed_hashes
+
+    def add(self, feed_id: int, guid_hashes: Iterable[bytes]):
+        """Добавляет хеши GUID ленты (в том числе создает запись ленты при первом прогреве из БД)."""
+        feed_hashes = self._feeds.get(feed_id)
+        if feed_hashes is None:
+            feed_hashes = OrderedDict()
+            self._feeds[feed_id] = feed_hashes
+        else:
+            self._feeds.move_to_end(feed_id)
+        for guid_hash in guid_hashes:
+            if guid_hash in feed_hashes:
+                feed_hashes.move_to_end(guid_hash)
+            else:
+                feed_hashes[guid_hash] = None
+                self._size += 1
+        # Самые старые хеши ленты вытесняются первыми
+        while len(feed_hashes) > self.max_entries_per_feed:
+            feed_hashes.popitem(last=False)
+            self._size -= 1
+        self._evict(feed_id)
+
+    def discard(self, feed_id: int):
+        """Забывает ленту целиком (например, после ее удаления: id может быть выдан новой ленте)."""
+        feed_hashes = self._feeds.pop(feed_id, None)
+        if feed_hashes is not None:
+            self._size -= len(feed_hashes)
+
+    def clear(self):
+        self._feeds.clear()
+        self._size = 0
+
+    def _evict(self, current_feed_id: int):
+        # Сначала вытесняем другие ленты, затем самые старые хеши текущей, если она одна не помещается
+        while self._size > self.max_entries and len(self._feeds) > 1:
+            evicted_feed_id, evicted_hashes = next(iter(self._feeds.items()))
+            if evicted_feed_id == current_feed_id:
+                self._feeds.move_to_end(current_feed_id)
+                continue
+            del self._feeds[evicted_feed_id]
+            self._size -= len(evicted_hashes)
+            logger.debug(f"Лента ID {evicted_feed_id} вытеснена из кеша обработанных GUID.")
+        feed_hashes = self._feeds.get(current_feed_id)
+        while self._size > self.max_entries and feed_hashes:
+            feed_hashes.popitem(last=False)
+            self._size -= 1
+
+
+# Общий кеш процесса
+seen_guid_cache = SeenGuidCache(SEEN_GUID_CACHE_MAX_MB * 1024 * 1024 // _ENTRY_SIZE_BYTES, FEED_RECENT_GUIDS_LIMIT)
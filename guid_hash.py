@@ -0,0 +1,24 @@
+# guid_hash.py
+# Хеши GUID постов. Модуль без зависимостей: его импортируют и database, и процессы пула разбора лент
+import hashlib
+from typing import Optional
+
+# Размер хеша GUID (BLAKE2b), которым посты индексируются вместо самой строки GUID
+GUID_HASH_SIZE = 16
+# До перехода на хеши GUID длиннее этого значения хранились обрезанными, и миграция хешировала обрезанную строку
+LEGACY_GUID_MAX_LENGTH = 512
+
+
+def hash_guid(post_guid: str) -> bytes:
+    """Возвращает 16-байтный BLAKE2b хеш GUID поста (ключ для поиска дубликатов)."""
+    return hashlib.blake2b(post_guid.encode('utf-8', 'surrogatepass'), digest_size=GUID_HASH_SIZE).digest()
+
+
+def legacy_guid_hash(post_guid: str) -> Optional[bytes]:
+    """
+    Возвращает хеш GUID в обрезанном виде, под которым длинный GUID мог быть сохранен до перехода
+    на хеши, или None для GUID, которые никогда не обрезались.
+    """
+    if len(post_guid) <= LEGACY_GUID_MAX_LENGTH:
+        return None
+    return hash_guid(post_guid[:LEGACY_GUID_MAX_LENGTH])
@@ -1,4 +1,5 @@
 # handlers/feeds.py
+import html
 import logging
 import asyncio # Добавим asyncio для sleep
 
@@ -9,11 +10,12 @@ from telegram.constants import ParseMode # Импортируем ParseMode от
 # Локальные импорты
 from config import BOT_MODE
 from database import (
-    get_db, get_all_feeds, add_feed, get_feed, delete_feed, update_feed_delay
+    get_db, get_all_feeds, add_feed, get_feed, delete_feed, update_feed_delay,
+    update_feed_check_bounds, get_feed_check_bounds, get_feed_check_interval
 )
 from constants import (
     FEEDS_MENU, ADD_FEED_URL, ADD_FEED_DELAY, ADD_FEED_NAME,
-    DELETE_FEED_CONFIRM, SET_DELAY_VALUE, FEED_URL, FEED_DELAY, FEED_ID, PAGE_SIZE
+    DELETE_FEED_CONFIRM, SET_DELAY_VALUE, SET_INTERVAL_VALUE, FEED_URL, FEED_DELAY, FEED_ID, PAGE_SIZE
 )
 from keyboards import (
     build_feeds_menu_keyboard, build_paginated_list_keyboard, build_back_button
@@ -26,6 +28,20 @@ logger = logging.getLogger(__name__)
 
 # --- Просмотр списка лент ---
 
+def _format_feed_status(feed, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Строка о сбоях ленты: приостановка (circuit breaker), пробная проверка или неудачные проверки подряд."""
+    error = html.escape(feed.last_error or '?')
+    if feed.circuit_state == 'open' and feed.suspended_until:
+        return get_text("feed_status_suspended", context, error=error,
+                        until=feed.suspended_until.strftime('%Y-%m-%d %H:%M UTC'),
+                        failures=feed.consecutive_failures)
+    if feed.circuit_state in ('open', 'half_open'):
+        return get_text("feed_status_half_open", context, error=error)
+    if feed.consecutive_failures:
+        return get_text("feed_status_failing", context, error=error, failures=feed.consecutive_failures)
+    return ""
+
+
 async def list_feeds_button(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 1) -> int:
     """Отображает список RSS-лент с пагинацией и кнопками управления."""
     query = update.callback_query
@@ -66,11 +82,17 @@ async def list_feeds_button(update: Update, context: ContextTypes.DEFAULT_TYPE,
             for feed in paginated_feeds:
                  feed_name = feed.name or get_text("feed_item_name", context, item_id=feed.id)
                  last_checked_str = feed.last_checked.strftime('%Y-%m-%d %H:%M:%S %Z') if feed.last_checked else 'Never' # TODO: Localize 'Never'
+                 min_interval, max_interval = get_feed_check_bounds(feed)
                  feed_info = (
                      f"<b>{feed_name} (ID: {feed.id})</b>\n"
                      f"<a href='{feed.url}'>URL</a> | Delay: {feed.publish_delay_minutes} min\n" # TODO: Localize 'Delay', 'min'
-                     f"Checked: {last_checked_str}" # TODO: Localize 'Checked'
+                     f"Checked: {last_checked_str}\n" # TODO: Localize 'Checked'
+                     + get_text("feed_check_interval_info", context, interval=round(get_feed_check_interval(feed)),
+                                min_interval=min_interval, max_interval=max_interval)
                  )
+                 feed_status = _format_feed_status(feed, context)
+                 if feed_status:
+                     feed_info += "\n" + feed_status
                  text += feed_info + "\n\n"
 
             # Строим клавиатуру с пагинацией и кнопками действий, передавая переводы
@@ -90,7 +112,8 @@ async def list_feeds_button(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 channel_item_name_format="", # Не используется для лент
                 feed_action_delay_format=get_text("feed_action_delay", context),
                 feed_action_delete_text=get_text("feed_action_delete", context),
-                channel_action_delete_text="" # Не используется для лент
+                channel_action_delete_text="", # Не используется для лент
+                feed_action_interval_format=get_text("feed_action_set_interval", context)
             )
 
         if len(text) > 4096: # Telegram limit
@@ -220,7 +243,7 @@ async def add_feed_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # --- Управление существующими лентами (удаление, задержка) ---
 
 async def feed_action_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обрабатывает нажатия кнопок действий (удалить, изменить задержку) для ленты."""
+    """Обрабатывает нажатия кнопок действий (удалить, изменить задержку или интервал проверки) для ленты."""
     query = update.callback_query
     if not is_authorized(update):
         await query.answer(get_text("no_access_inline", context), show_alert=True)
@@ -257,6 +280,22 @@ async def feed_action_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             else:
                 await query.edit_message_text(get_text("delete_feed_not_found", context)) # Используем текст "не найдено"
                 return await feeds_menu_back(update, context) # Локализованный возврат
+    elif action_prefix == "set_interval" and command == "start":
+        # Начинаем диалог установки границ интервала проверки
+        with next(get_db()) as db:
+            owner_id = update.effective_user.id if BOT_MODE == 'public' else None
+            feed = get_feed(db, feed_id=item_id, user_id=owner_id)
+            if feed:
+                min_interval, max_interval = get_feed_check_bounds(feed)
+                prompt_text = get_text("set_interval_prompt", context,
+                                       feed_name=(feed.name or feed.url),
+                                       interval=round(get_feed_check_interval(feed)),
+                                       min_interval=min_interval, max_interval=max_interval)
+                await query.edit_message_text(prompt_text)
+                return SET_INTERVAL_VALUE # Переходим в состояние ожидания границ интервала
+            else:
+                await query.edit_message_text(get_text("delete_feed_not_found", context))
+                return await feeds_menu_back(update, context)
     else:
         logger.warning(f"Unknown callback in feed_action_handler: {data}")
         await query.message.reply_text(get_text("unknown_command", context))
@@ -404,3 +443,36 @@ async def set_delay_value_handler(update: Update, context: ContextTypes.DEFAULT_
     # context.user_data['_origin_message'] = query.message # Примерно так
 
     return await list_feeds_button(fake_update, context)
+
+# --- Установка интервала проверки ---
+
+async def set_interval_value_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Получает границы интервала проверки ленты ("мин макс" в минутах) и сохраняет их в БД."""
+    if not is_authorized(update):
+        await update.message.reply_text(get_text("no_access", context))
+        return ConversationHandler.END
+
+    feed_id = context.user_data.get(FEED_ID)
+    if not feed_id:
+        await update.message.reply_text(get_text("error_occurred", context))
+        return await feeds_menu_back(update, context)
+
+    values = update.message.text.split()
+    if len(values) != 2 or not all(value.isdigit() for value in values) \
+            or not 1 <= int(values[0]) <= int(values[1]):
+        await update.message.reply_text(get_text("set_interval_invalid", context))
+        return SET_INTERVAL_VALUE # Остаемся в том же состоянии
+    min_interval, max_interval = int(values[0]), int(values[1])
+
+    with next(get_db()) as db:
+        owner_id = update.effective_user.id if BOT_MODE == 'public' else None
+        feed = get_feed(db, feed_id=feed_id, user_id=owner_id)
+        if feed and update_feed_check_bounds(db, feed_id, min_interval, max_interval, user_id=owner_id):
+            await update.message.reply_text(get_text("set_interval_success", context,
+                                                     feed_name=(feed.name or feed.url),
+                                                     min_interval=min_interval, max_interval=max_interval))
+        else:
+            await update.message.reply_text(get_text("delete_feed_not_found", context))
+
+    context.user_data.pop(FEED_ID, None)
+    return await feeds_menu_back(update, context)
@@ -2,17 +2,17 @@
 import logging
 import asyncio
 
-from telegram import Update, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode # Правильный импорт ParseMode
 
 # Локальные импорты
-from config import BOT_MODE
+from config import BOT_MODE, DIGEST_WINDOW_MINUTES
 from database import (
     get_db, get_all_feeds, get_all_channels, get_channel, get_feed,
     subscribe_channel_to_feed, unsubscribe_channel_from_feed,
     get_subscriptions_for_channel, get_subscription, update_subscription_hashtags,
-    format_hashtags
+    update_subscription_digest_mode, format_hashtags
 )
 from constants import (
     SUBS_MENU, SUBSCRIBE_SELECT_FEED, SUBSCRIBE_SELECT_CHANNEL, SUBSCRIBE_GET_HASHTAGS,
@@ -506,29 +506,80 @@ async def list_subs_select_channel(update: Update, context: ContextTypes.DEFAULT
             )
             return SUBS_MENU
 
-        subscriptions = get_subscriptions_for_channel(db, channel_id=channel_db_id, user_id=owner_id)
-        text = get_text("list_subs_title", context, channel_name=(channel.name or channel.chat_id)) + "\n\n"
-        if not subscriptions:
-            text += get_text("list_subs_empty", context)
-        else:
-            for sub in subscriptions:
-                feed = sub.feed
-                hashtags_display = sub.hashtags or get_text("list_subs_no_hashtags", context)
-                feed_name = feed.name or get_text("feed_item_name", context, item_id=feed.id)
-                text += get_text("list_subs_entry", context,
-                                 feed_name=feed_name,
-                                 feed_id=feed.id,
-                                 hashtags=hashtags_display) + "\n\n"
+        text, keyboard = _build_channel_subscriptions_view(db, context, channel, owner_id)
+        await query.edit_message_text(
+            text=text,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.HTML, # Используем правильную константу
+            disable_web_page_preview=True
+        )
 
-        keyboard = InlineKeyboardMarkup([build_back_button(get_text("back_button", context), "list_subs_start")])
+    return LIST_SUBS_SELECT_CHANNEL
 
-        if len(text) > 4096:
-            text = text[:4090] + "..."
+def _build_channel_subscriptions_view(db, context: ContextTypes.DEFAULT_TYPE, channel, owner_id):
+    """Формирует текст списка подписок канала и клавиатуру с переключателями режима дайджеста."""
+    subscriptions = get_subscriptions_for_channel(db, channel_id=channel.id, user_id=owner_id)
+    text = get_text("list_subs_title", context, channel_name=(channel.name or channel.chat_id)) + "\n\n"
+    keyboard_rows = []
+    if not subscriptions:
+        text += get_text("list_subs_empty", context)
+    else:
+        for sub in subscriptions:
+            feed = sub.feed
+            hashtags_display = sub.hashtags or get_text("list_subs_no_hashtags", context)
+            feed_name = feed.name or get_text("feed_item_name", context, item_id=feed.id)
+            text += get_text("list_subs_entry", context,
+                             feed_name=feed_name,
+                             feed_id=feed.id,
+                             hashtags=hashtags_display)
+            if sub.digest_mode:
+                text += "\n" + get_text("list_subs_digest_mode", context, window=DIGEST_WINDOW_MINUTES)
+            text += "\n\n"
+            toggle_key = "digest_toggle_off_button" if sub.digest_mode else "digest_toggle_on_button"
+            keyboard_rows.append([InlineKeyboardButton(
+                get_text(toggle_key, context, feed_name=feed_name),
+                callback_data=f"digest_toggle_{channel.id}_{feed.id}"
+            )])
+
+    keyboard_rows.append(build_back_button(get_text("back_button", context), "list_subs_start"))
+
+    if len(text) > 4096:
+        text = text[:4090] + "..."
+    return text, InlineKeyboardMarkup(keyboard_rows)
+
+async def toggle_digest_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Включает или выключает режим дайджеста подписки из списка подписок канала."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    if not is_authorized(update):
+        await query.answer(get_text("no_access_inline", context), show_alert=True)
+        return SUBS_MENU
+
+    try:
+        channel_db_id, feed_id = map(int, query.data.replace("digest_toggle_", "").split("_"))
+    except (ValueError, AttributeError):
+        logger.error(f"Invalid callback_data in toggle_digest_mode: {query.data}")
+        await query.answer(get_text("error_occurred", context), show_alert=True)
+        return LIST_SUBS_SELECT_CHANNEL
 
+    with next(get_db()) as db:
+        owner_id = user_id if BOT_MODE == 'public' else None
+        channel = get_channel(db, channel_db_id=channel_db_id, user_id=owner_id)
+        subscription = get_subscription(db, channel_id=channel_db_id, feed_id=feed_id, user_id=owner_id) if channel else None
+        if not subscription:
+            await query.answer(get_text("item_not_found", context), show_alert=True)
+            return LIST_SUBS_SELECT_CHANNEL
+
+        digest_mode = not subscription.digest_mode
+        update_subscription_digest_mode(db, channel_id=channel_db_id, feed_id=feed_id, digest_mode=digest_mode, user_id=owner_id)
+        feed_name = subscription.feed.name or get_text("feed_item_name", context, item_id=feed_id)
+        await query.answer(get_text("digest_mode_enabled" if digest_mode else "digest_mode_disabled", context, feed_name=feed_name))
+
+        text, keyboard = _build_channel_subscriptions_view(db, context, channel, owner_id)
         await query.edit_message_text(
             text=text,
             reply_markup=keyboard,
-            parse_mode=ParseMode.HTML, # Используем правильную константу
+            parse_mode=ParseMode.HTML,
             disable_web_page_preview=True
         )
 
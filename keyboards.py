@@ -6,12 +6,13 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton,
 # Импортируем модели для type hints
 # Подразумевается, что модели RSSFeed, Channel, ChannelFeedLink определены в database.py
 try:
-    from database import RSSFeed, Channel, ChannelFeedLink
+    from database import RSSFeed, Channel, ChannelFeedLink, get_feed_check_interval
 except ImportError:
     # Заглушки, если модели не найдены (для статической проверки)
     class RSSFeed: pass
     class Channel: pass
     class ChannelFeedLink: pass
+    def get_feed_check_interval(feed): return feed.check_interval_minutes or feed.update_interval_minutes
 
 # --- Клавиатуры (теперь принимают переведенные тексты) ---
 
@@ -97,7 +98,8 @@ def build_paginated_list_keyboard(
     channel_item_name_format: str,
     feed_action_delay_format: str,
     feed_action_delete_text: str,
-    channel_action_delete_text: str
+    channel_action_delete_text: str,
+    feed_action_interval_format: str = ""
 ) -> InlineKeyboardMarkup:
     """Строит клавиатуру для списка с пагинацией и кнопками действий, используя переводы."""
     keyboard_layout = []
@@ -131,6 +133,9 @@ def build_paginated_list_keyboard(
         if isinstance(item, RSSFeed):
             delay_text = feed_action_delay_format.format(delay=item.publish_delay_minutes)
             action_buttons.append(InlineKeyboardButton(delay_text, callback_data=f"set_delay_start_{item.id}"))
+            if feed_action_interval_format:
+                interval_text = feed_action_interval_format.format(interval=round(get_feed_check_interval(item)))
+                action_buttons.append(InlineKeyboardButton(interval_text, callback_data=f"set_interval_start_{item.id}"))
             action_buttons.append(InlineKeyboardButton(feed_action_delete_text, callback_data=f"delete_feed_confirm_{item.id}"))
         elif isinstance(item, Channel):
             action_buttons.append(InlineKeyboardButton(channel_action_delete_text, callback_data=f"delete_channel_confirm_{item.id}"))
@@ -0,0 +1,484 @@
+# publisher.py
+import logging
+from datetime import datetime, timedelta, timezone
+import asyncio
+import html
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+import os
+import socket
+import time
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.error import TelegramError, BadRequest, NetworkError, RetryAfter
+from telegram.constants import ParseMode
+
+# Локальные импорты
+from database import (
+    get_db, Channel, PostEntry, ScheduledPost,
+    claim_due_scheduled_posts, release_scheduled_post_claims, get_next_scheduled_time,
+    update_scheduled_post_status, reschedule_scheduled_post
+)
+from config import (
+    PUBLISH_BATCH_SIZE, PUBLISHER_MAX_IDLE_SECONDS, PUBLISH_MAX_IN_FLIGHT,
+    TELEGRAM_GLOBAL_RATE_PER_SECOND, TELEGRAM_CHAT_RATE_PER_MINUTE, TELEGRAM_CHAT_BURST,
+    PUBLISH_MAX_ATTEMPTS, PUBLISH_RETRY_BASE_SECONDS, PUBLISH_RETRY_MAX_SECONDS,
+    PUBLISH_CLAIM_TIMEOUT_SECONDS, PUBLISH_SPLIT_LONG_MESSAGES, PUBLISH_MAX_MESSAGE_PARTS
+)
+from rate_limiter import DeliveryRateLimiter
+from telegram_html import TELEGRAM_MESSAGE_LIMIT, sanitize_html, iter_html_parts, truncate_html, utf16_length
+
+logger = logging.getLogger(__name__)
+
+# --- Форматирование и отправка ---
+
+def render_post_body(title: Optional[str], link: Optional[str], summary_html: Optional[str]) -> str:
+    """Форматирует общую для всех каналов часть сообщения (без хештегов и без обрезки)."""
+    title = html.escape(title or 'Без заголовка')
+    link = html.escape(link or '')
+    # HTML из ленты приводится к тегам, которые принимает Telegram, иначе отправка упадет с BadRequest
+    summary_html = sanitize_html(summary_html)
+
+    message = f"<b>{title}</b>\n\n"
+    if summary_html:
+        message += f"{summary_html}\n\n"
+    if link:
+        message += f'\n<a href="{link}">Источник</a>'
+    return message
+
+
+def finish_message(body: str, hashtags: Optional[str]) -> List[str]:
+    """
+    Добавляет к готовому телу сообщения хештеги канала и приводит его к лимиту Telegram.
+    Длина считается так же, как в Telegram (UTF-16, без учета тегов), а разрез не ломает разметку.
+    Возвращает список сообщений: одно (обрезанное) или, при PUBLISH_SPLIT_LONG_MESSAGES,
+    до PUBLISH_MAX_MESSAGE_PARTS частей.
+    """
+    message = f"{body}\n\n{html.escape(hashtags)}" if hashtags else body
+    if not PUBLISH_SPLIT_LONG_MESSAGES:
+        return [truncate_html(message, TELEGRAM_MESSAGE_LIMIT, "...")]
+    parts = list(islice(iter_html_parts(message, TELEGRAM_MESSAGE_LIMIT), PUBLISH_MAX_MESSAGE_PARTS + 1))
+    if len(parts) > PUBLISH_MAX_MESSAGE_PARTS:
+        parts = parts[:PUBLISH_MAX_MESSAGE_PARTS]
+        parts[-1] = next(iter_html_parts(parts[-1], TELEGRAM_MESSAGE_LIMIT - 3)) + "..."
+    return parts
+
+
+def format_scheduled_message(scheduled_post: ScheduledPost, entry: Optional[PostEntry] = None) -> List[str]:
+    """
+    Форматирует отложенный пост для отправки в Telegram (список из одного или нескольких сообщений).
+    Содержимое берется из entry, для старых строк очереди без entry - из колонок самого поста.
+    """
+    if entry is not None:
+        body = render_post_body(entry.title, entry.link, entry.summary)
+    else:
+        body = render_post_body(scheduled_post.post_title, scheduled_post.post_link, scheduled_post.post_summary)
+    return finish_message(body, scheduled_post.hashtags)
+
+
+def render_digest(items: List[Tuple[Optional[str], Optional[str]]], hashtags: Optional[str]) -> List[str]:
+    """
+    Форматирует дайджест: по строке "• заголовок" со ссылкой на каждый пост (items - пары
+    заголовок, ссылка). Строки раскладываются по сообщениям так, чтобы каждое укладывалось
+    в лимит Telegram, хештеги добавляются в конец последнего сообщения.
+    """
+    lines = []
+    for title, link in items:
+        title = title or 'Без заголовка'
+        line = f"• {html.escape(title)}"
+        if link:
+            line = f'• <a href="{html.escape(link)}">{html.escape(title)}</a>'
+        lines.append((line, utf16_length(f"• {title}")))
+    if hashtags:
+        lines.append((f"\n{html.escape(hashtags)}", utf16_length(hashtags) + 1))
+
+    messages = []
+    current: List[str] = []
+    current_length = 0
+    for line, line_length in lines:
+        if line_length > TELEGRAM_MESSAGE_LIMIT:
+            line, line_length = truncate_html(line, TELEGRAM_MESSAGE_LIMIT, "..."), TELEGRAM_MESSAGE_LIMIT
+        # +1 - перевод строки между строками дайджеста
+        if current and current_length + 1 + line_length > TELEGRAM_MESSAGE_LIMIT:
+            messages.append("\n".join(current))
+            current, current_length = [], 0
+        current_length += line_length + (1 if current else 0)
+        current.append(line)
+    if current:
+        messages.append("\n".join(current))
+    return messages
+
+
+class _MessageRenderCache:
+    """
+    Кеш сообщений на один проход публикатора: тело поста форматируется один раз на запись
+    post_entries, а каналы с одинаковыми хештегами получают один и тот же готовый объект строки.
+    """
+
+    def __init__(self, entries: Dict[int, PostEntry]):
+        self._entries = entries
+        self._bodies: Dict[int, str] = {}
+        self._messages: Dict[Tuple[int, Optional[str]], List[str]] = {}
+
+    def render(self, scheduled_post: ScheduledPost) -> List[str]:
+        entry = self._entries.get(scheduled_post.entry_id)
+        if entry is None:
+            # Старая строка очереди с содержимым в самой строке - кешировать нечего
+            return format_scheduled_message(scheduled_post)
+        key = (entry.id, scheduled_post.hashtags or None)
+        message = self._messages.get(key)
+        if message is None:
+            body = self._bodies.get(entry.id)
+            if body is None:
+                body = render_post_body(entry.title, entry.link, entry.summary)
+                self._bodies[entry.id] = body
+            message = finish_message(body, scheduled_post.hashtags)
+            self._messages[key] = message
+        return message
+
+    def render_digest(self, scheduled_posts: List[ScheduledPost]) -> List[str]:
+        """Форматирует дайджест из постов одного канала; хештеги всех подписок объединяются."""
+        items = []
+        for scheduled_post in scheduled_posts:
+            entry = self._entries.get(scheduled_post.entry_id)
+            if entry is not None:
+                items.append((entry.title, entry.link))
+            else:
+                items.append((scheduled_post.post_title, scheduled_post.post_link))
+        tags = dict.fromkeys(tag for post in scheduled_posts for tag in (post.hashtags or '').split())
+        return render_digest(items, " ".join(tags) or None)
+
+# --- Публикация ---
+# Посты рассылаются параллельно по разным чатам: у каждого чата своя очередь и воркер,
+# а частоту отправки ограничивают общий и per-chat token bucket'ы.
+
+@dataclass
+class _Delivery:
+    """Подготовленное к отправке сообщение (без привязки к сессии БД)."""
+    # Один пост или, для дайджеста, все посты, собранные в сообщение
+    post_ids: List[int]
+    chat_id: str
+    parts: List[str]
+    post_guid: str
+    attempts: int = 0
+    # Сколько частей длинного сообщения уже отправлено
+    sent_parts: int = 0
+
+    @property
+    def label(self) -> str:
+        """Описание для логов (в родительном падеже)."""
+        if len(self.post_ids) == 1:
+            return f"отложенного поста ID {self.post_ids[0]}"
+        return f"дайджеста из {len(self.post_ids)} постов (ID {', '.join(map(str, self.post_ids))})"
+
+
+# Идентификатор этого процесса-публикатора (для claimed_by)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+_limiter: Optional[DeliveryRateLimiter] = None
+_chat_queues: Dict[str, Deque[_Delivery]] = {}
+_chat_workers: Dict[str, asyncio.Task] = {}
+# ID постов, уже переданных воркерам, но еще не получивших итоговый статус
+_in_flight: Set[int] = set()
+
+
+def _get_limiter() -> DeliveryRateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = DeliveryRateLimiter(TELEGRAM_GLOBAL_RATE_PER_SECOND, TELEGRAM_CHAT_RATE_PER_MINUTE, TELEGRAM_CHAT_BURST)
+    return _limiter
+
+
+def _save_post_status(delivery: _Delivery, status: str):
+    """Сохраняет итоговый статус постов сообщения в отдельной короткой сессии."""
+    try:
+        with next(get_db()) as db:
+            for post_id in delivery.post_ids:
+                update_scheduled_post_status(db, post_id, status)
+            db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения статуса '{status}' для {delivery.label}: {e}")
+
+
+def _release_claims(post_ids: List[int]):
+    """Снимает отметку 'sending' с постов, которые не удалось отправить в этом процессе."""
+    try:
+        with next(get_db()) as db:
+            release_scheduled_post_claims(db, post_ids=post_ids)
+            db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка возврата постов {post_ids} в очередь: {e}")
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """Возвращает retry_after в секундах (в разных версиях PTB это int или timedelta)."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _reschedule_post(delivery: _Delivery, delay_seconds: float):
+    """Возвращает посты сообщения в очередь через delay_seconds секунд в отдельной короткой сессии."""
+    scheduled_time = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+    try:
+        with next(get_db()) as db:
+            for post_id in delivery.post_ids:
+                reschedule_scheduled_post(db, post_id, scheduled_time)
+            db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка переноса {delivery.label}: {e}")
+
+
+async def _send_delivery(bot: Bot, delivery: _Delivery) -> Tuple[str, float]:
+    """
+    Отправляет очередную часть сообщения. Возвращает статус и, для "retry", через сколько секунд
+    повторить попытку: "published", "failed", "retry" (временная ошибка, попытка засчитывается)
+    или "wait" (flood control: чат приостановлен, та же часть повторяется после паузы).
+    """
+    try:
+        await bot.send_message(
+            chat_id=delivery.chat_id, text=delivery.parts[delivery.sent_parts],
+            parse_mode=ParseMode.HTML, disable_web_page_preview=False
+        )
+        delivery.sent_parts += 1
+        if delivery.sent_parts == len(delivery.parts):
+            logger.info(f"Отправка {delivery.label} (GUID: {delivery.post_guid}) в канал {delivery.chat_id} успешно завершена.")
+        return "published", 0.0
+    except RetryAfter as e:
+        # Flood control: пост не теряем и не считаем неудачей, а повторяем, когда Telegram разрешит
+        retry_after = _retry_after_seconds(e)
+        logger.warning(f"Flood control при отправке {delivery.label} в канал {delivery.chat_id}: повтор через {retry_after:.0f} с.")
+        _get_limiter().pause_chat(delivery.chat_id, retry_after)
+        return "wait", retry_after
+    except BadRequest as e:
+        # BadRequest - подкласс NetworkError, но повтор тут не поможет
+        logger.error(f"Ошибка BadRequest при отправке {delivery.label} в канал {delivery.chat_id}: {e}")
+    except NetworkError as e:
+        # TimedOut и прочие временные сетевые ошибки - повтор с экспоненциальной задержкой
+        if delivery.attempts + 1 < PUBLISH_MAX_ATTEMPTS:
+            delay = min(PUBLISH_RETRY_BASE_SECONDS * (2 ** delivery.attempts), PUBLISH_RETRY_MAX_SECONDS)
+            logger.warning(f"Временная ошибка при отправке {delivery.label} в канал {delivery.chat_id}: {e}. Повтор через {delay:.0f} с.")
+            return "retry", delay
+        logger.error(f"Ошибка сети при отправке {delivery.label} в канал {delivery.chat_id}: {e}. Попытки исчерпаны ({PUBLISH_MAX_ATTEMPTS}).")
+    except TelegramError as e:
+        logger.error(f"Ошибка Telegram при отправке {delivery.label} в канал {delivery.chat_id}: {e}")
+    except Exception as e:
+        logger.error(f"Непредвиденная ошибка при отправке {delivery.label} в канал {delivery.chat_id}: {e}", exc_info=True)
+    return "failed", 0.0
+
+
+async def _run_chat_worker(bot: Bot, chat_id: str):
+    """Последовательно (с соблюдением лимитов) отправляет очередь одного чата."""
+    limiter = _get_limiter()
+    queue = _chat_queues[chat_id]
+    unfinished: List[_Delivery] = []
+    try:
+        while queue:
+            delivery = queue.popleft()
+            unfinished = [delivery]
+            status, retry_delay = "published", 0.0
+            while delivery.sent_parts < len(delivery.parts):
+                await limiter.acquire(chat_id)
+                status, retry_delay = await _send_delivery(bot, delivery)
+                if status == "wait":
+                    # Повторяем то же сообщение после паузы чата (ее выдерживает limiter.acquire),
+                    # а не через очередь в БД: следующие посты чата не должны обогнать этот
+                    continue
+                if status == "retry" and delivery.sent_parts:
+                    # Начало поста уже в канале: остальные части повторяем здесь, а не через очередь,
+                    # иначе при повторе из БД первые части были бы отправлены дважды
+                    delivery.attempts += 1
+                    await asyncio.sleep(retry_delay)
+                    continue
+                if status != "published":
+                    break
+            if status == "retry":
+                _reschedule_post(delivery, retry_delay)
+            else:
+                _save_post_status(delivery, status)
+            unfinished = []
+            _in_flight.difference_update(delivery.post_ids)
+    finally:
+        # Посты, не отправленные из-за остановки, возвращаем в очередь для следующего запуска
+        unfinished.extend(queue)
+        if unfinished:
+            _release_claims([post_id for delivery in unfinished for post_id in delivery.post_ids])
+            for delivery in unfinished:
+                _in_flight.difference_update(delivery.post_ids)
+        _chat_queues.pop(chat_id, None)
+        _chat_workers.pop(chat_id, None)
+        notify_publisher() # Освободилось место - возможно, в очереди ждут еще посты
+
+
+async def publish_due_posts(bot: Bot) -> int:
+    """
+    Берет из очереди пачку отложенных постов, время которых наступило, и раздает их воркерам чатов.
+    Возвращает число переданных на отправку постов.
+    """
+    capacity = PUBLISH_MAX_IN_FLIGHT - len(_in_flight)
+    if capacity <= 0:
+        return 0
+    limit = min(PUBLISH_BATCH_SIZE, capacity)
+    deliveries = []
+    failed_count = 0
+
+    with next(get_db()) as db:
+        # Забранные посты получают статус 'sending' и не попадут в следующую выборку
+        posts_to_publish = claim_due_scheduled_posts(db, WORKER_ID, limit=limit)
+        if not posts_to_publish:
+            logger.info("Нет отложенных постов для публикации.")
+            return 0
+        logger.info(f"Найдено {len(posts_to_publish)} отложенных постов для публикации.")
+
+        channel_ids = {post.channel_id for post in posts_to_publish}
+        channels = {channel.id: channel for channel in db.query(Channel).filter(Channel.id.in_(channel_ids)).all()}
+        # Содержимое загружается один раз на пост ленты, даже если он уходит в десятки каналов
+        entry_ids = {post.entry_id for post in posts_to_publish if post.entry_id is not None}
+        entries = {entry.id: entry for entry in db.query(PostEntry).filter(PostEntry.id.in_(entry_ids)).all()} if entry_ids else {}
+        render_cache = _MessageRenderCache(entries)
+        # Посты подписок в режиме дайджеста собираются по чатам и уходят одним сообщением
+        digest_posts: Dict[str, List[ScheduledPost]] = {}
+
+        for scheduled_post in posts_to_publish:
+            channel = channels.get(scheduled_post.channel_id)
+            if not channel:
+                logger.error(f"Не найден канал (внутр. ID {scheduled_post.channel_id}) для отложенного поста ID {scheduled_post.id}. Помечаем как failed.")
+                update_scheduled_post_status(db, scheduled_post.id, "failed")
+                failed_count += 1
+                continue
+            if scheduled_post.digest:
+                digest_posts.setdefault(channel.chat_id, []).append(scheduled_post)
+                continue
+            deliveries.append(_Delivery(
+                post_ids=[scheduled_post.id], chat_id=channel.chat_id,
+                parts=render_cache.render(scheduled_post), post_guid=scheduled_post.post_guid,
+                attempts=scheduled_post.attempts or 0
+            ))
+
+        for chat_id, chat_posts in digest_posts.items():
+            if len(chat_posts) == 1:
+                # Один пост за окно отправляется обычным сообщением
+                parts = render_cache.render(chat_posts[0])
+            else:
+                parts = render_cache.render_digest(chat_posts)
+            deliveries.append(_Delivery(
+                post_ids=[post.id for post in chat_posts], chat_id=chat_id, parts=parts,
+                post_guid=chat_posts[0].post_guid if len(chat_posts) == 1 else f"дайджест, {len(chat_posts)} шт.",
+                attempts=max(post.attempts or 0 for post in chat_posts)
+            ))
+
+        if failed_count:
+            try:
+                db.commit()
+            except Exception as e:
+                logger.error(f"Ошибка commit при обновлении статусов отложенных постов: {e}")
+                db.rollback()
+
+    _get_limiter().prune()
+    for delivery in deliveries:
+        _in_flight.update(delivery.post_ids)
+        _chat_queues.setdefault(delivery.chat_id, deque()).append(delivery)
+        if delivery.chat_id not in _chat_workers:
+            _chat_workers[delivery.chat_id] = asyncio.create_task(_run_chat_worker(bot, delivery.chat_id))
+
+    logger.info(f"Передано на отправку {len(deliveries)} сообщений ({len(posts_to_publish) - failed_count} постов) в {len({d.chat_id for d in deliveries})} чатов. Ошибок: {failed_count}.")
+    return len(posts_to_publish)
+
+
+# --- Фоновый публикатор ---
+# Вместо ежеминутного опроса публикатор спит до ближайшего scheduled_time
+# и просыпается сразу, когда проверка лент добавляет новые посты в очередь.
+
+_publisher_task: Optional[asyncio.Task] = None
+_wake_event: Optional[asyncio.Event] = None
+# Пауза перед повтором, если готовые посты есть, но обработать их не удалось (например, ошибка commit)
+_STALLED_RETRY_SECONDS = 10.0
+
+
+def _release_stale_claims(on_start: bool = False):
+    """
+    Возвращает в очередь посты, забранные упавшими публикаторами. При старте процесса
+    освобождаются и собственные отметки (WORKER_ID совпадает, например, после перезапуска контейнера).
+    """
+    try:
+        with next(get_db()) as db:
+            if on_start:
+                release_scheduled_post_claims(db, claimed_by=WORKER_ID)
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=PUBLISH_CLAIM_TIMEOUT_SECONDS)
+            release_scheduled_post_claims(db, claimed_before=cutoff, exclude_claimed_by=WORKER_ID)
+            db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка возврата зависших постов в очередь: {e}")
+
+
+def _seconds_until_next_post() -> Optional[float]:
+    """Возвращает число секунд до ближайшего отложенного поста или None, если очередь пуста."""
+    with next(get_db()) as db:
+        next_time = get_next_scheduled_time(db)
+    if next_time is None:
+        return None
+    if next_time.tzinfo is None:
+        next_time = next_time.replace(tzinfo=timezone.utc)
+    return max(0.0, (next_time - datetime.now(timezone.utc)).total_seconds())
+
+
+async def _run_publisher(bot: Bot):
+    """Основной цикл публикатора."""
+    logger.info("Публикатор отложенных постов запущен.")
+    _release_stale_claims(on_start=True)
+    stale_check_at = time.monotonic() + PUBLISH_CLAIM_TIMEOUT_SECONDS
+    while True:
+        _wake_event.clear()
+        if time.monotonic() >= stale_check_at:
+            _release_stale_claims()
+            stale_check_at = time.monotonic() + PUBLISH_CLAIM_TIMEOUT_SECONDS
+        try:
+            processed = await publish_due_posts(bot)
+            if processed >= PUBLISH_BATCH_SIZE:
+                continue # Пачка заполнена целиком - в очереди могут быть еще готовые посты
+            delay = _seconds_until_next_post()
+            if processed == 0 and delay == 0:
+                delay = _STALLED_RETRY_SECONDS
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в цикле публикатора: {e}", exc_info=True)
+            delay = PUBLISHER_MAX_IDLE_SECONDS
+
+        # Страховочный предел сна: на случай постов, добавленных в обход notify_publisher
+        timeout = PUBLISHER_MAX_IDLE_SECONDS if delay is None else min(delay, PUBLISHER_MAX_IDLE_SECONDS)
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(_wake_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+def start_publisher(bot: Bot):
+    """Запускает фоновый публикатор в текущем event loop."""
+    global _publisher_task, _wake_event
+    if _publisher_task is not None and not _publisher_task.done():
+        logger.warning("Публикатор уже запущен.")
+        return
+    _wake_event = asyncio.Event()
+    _publisher_task = asyncio.create_task(_run_publisher(bot), name="scheduled_post_publisher")
+
+
+def stop_publisher():
+    """Останавливает фоновый публикатор и воркеры чатов."""
+    global _publisher_task
+    if _publisher_task is not None and not _publisher_task.done():
+        _publisher_task.cancel()
+        logger.info("Публикатор отложенных постов остановлен.")
+    _publisher_task = None
+    for worker in list(_chat_workers.values()):
+        worker.cancel()
+
+
+def notify_publisher():
+    """Будит публикатор: в очередь добавлены новые посты."""
+    if _wake_event is not None:
+        _wake_event.set()
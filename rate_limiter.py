@@ -0,0 +1,161 @@
+# rate_limiter.py
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket: rate токенов в секунду, не более capacity в запасе.
+    Ожидающие получают токены по очереди (FIFO).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    @property
+    def is_idle(self) -> bool:
+        """True, если bucket полностью восстановился и его никто не ждет."""
+        self._refill()
+        return self._tokens >= self.capacity and not self._lock.locked() and time.monotonic() >= self._paused_until
+
+    def pause(self, seconds: float):
+        """Запрещает выдачу токенов на seconds секунд (например, по RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        """Ждет и забирает один токен."""
+        async with self._lock:
+            while True:
+                pause_left = self._paused_until - time.monotonic()
+                if pause_left > 0:
+                    await asyncio.sleep(pause_left)
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens -= 1
+
+
+class DeliveryRateLimiter:
+    """
+    Ограничитель отправки сообщений в Telegram: общий bucket на все чаты
+    и отдельный bucket на каждый чат (лимиты Telegram действуют на оба уровня).
+    """
+
+    def __init__(self, global_rate_per_second: float, chat_rate_per_minute: float, chat_burst: int):
+        self._global_bucket = TokenBucket(global_rate_per_second, global_rate_per_second)
+        self._chat_rate = chat_rate_per_minute / 60.0
+        self._chat_burst = chat_burst
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+
+    def _get_chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: str):
+        """Ждет разрешения на отправку одного сообщения в чат chat_id."""
+        # Сначала лимит чата, затем общий: пока чат ждет, общий лимит достается другим чатам
+        await self._get_chat_bucket(chat_id).acquire()
+        await self._global_bucket.acquire()
+
+    def pause_chat(self, chat_id: str, seconds: float):
+        """Приостанавливает отправку только в один чат."""
+        self._get_chat_bucket(chat_id).pause(seconds)
+
+    def prune(self):
+        """Удаляет bucket'ы чатов, которые полностью восстановились, чтобы словарь не рос бесконечно."""
+        idle_chats = [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle]
+        for chat_id in idle_chats:
+            del self._chat_buckets[chat_id]
+
+
+class _HostState:
+    def __init__(self, max_concurrency: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.next_start_at = 0.0
+        self.paused_until = 0.0
+        # HTTP статус ответа, из-за которого хост приостановлен
+        self.pause_status: Optional[int] = None
+        self.users = 0
+
+
+class HostRateLimiter:
+    """
+    Вежливая загрузка с одного хоста: не более max_concurrency запросов одновременно,
+    начала запросов разнесены не менее чем на min_delay секунд, а после 429/503
+    хост можно приостановить целиком.
+    """
+
+    def __init__(self, max_concurrency: int, min_delay: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_delay = max(0.0, min_delay)
+        self._hosts: Dict[str, _HostState] = {}
+
+    def _get_state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(self.max_concurrency)
+            self._hosts[host] = state
+        return state
+
+    def pause_left(self, host: str) -> float:
+        """Сколько секунд еще действует пауза для хоста (0, если паузы нет)."""
+        state = self._hosts.get(host)
+        return max(0.0, state.paused_until - time.monotonic()) if state else 0.0
+
+    def pause_status(self, host: str) -> Optional[int]:
+        """HTTP статус, из-за которого действует пауза хоста (None, если паузы нет)."""
+        return self._hosts[host].pause_status if self.pause_left(host) > 0 else None
+
+    def pause(self, host: str, seconds: float, status: Optional[int] = None):
+        """Приостанавливает запросы к хосту на seconds секунд (например, по Retry-After)."""
+        state = self._get_state(host)
+        state.paused_until = max(state.paused_until, time.monotonic() + seconds)
+        state.pause_status = status
+
+    @asynccontextmanager
+    async def request(self, host: str):
+        """Ждет свободного слота и очереди на запрос к хосту."""
+        state = self._get_state(host)
+        state.users += 1
+        try:
+            async with state.semaphore:
+                # Время старта резервируется до ожидания, поэтому ждущие запросы выстраиваются с шагом min_delay
+                now = time.monotonic()
+                start_at = max(now, state.next_start_at)
+                state.next_start_at = start_at + self.min_delay
+                if start_at > now:
+                    await asyncio.sleep(start_at - now)
+                yield
+        finally:
+            state.users -= 1
+
+    def prune(self):
+        """Удаляет состояние хостов без активных запросов, пауз и ожидания очереди."""
+        now = time.monotonic()
+        idle_hosts = [
+            host for host, state in self._hosts.items()
+            if state.users == 0 and state.next_start_at <= now and state.paused_until <= now
+        ]
+        for host in idle_hosts:
+            del self._hosts[host]
@@ -1,84 +1,494 @@
 # rss_parser.py
+import asyncio
 import feedparser
+import hashlib
+import httpx
 import logging
-from datetime import datetime
+import multiprocessing
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from time import mktime
-from typing import List, Dict, Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from config import (
+    FEED_FETCH_TIMEOUT_SECONDS, FEED_FETCH_DEADLINE_SECONDS, FEED_MAX_RESPONSE_BYTES,
+    FEED_HTTP_MAX_CONNECTIONS, FEED_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    FEED_PARSE_PROCESSES, FEED_PARSE_PROCESS_MIN_BYTES,
+    FEED_KNOWN_ENTRIES_TO_STOP, FEED_MAX_ENTRIES_PER_CHECK,
+    FEED_HOST_MAX_CONCURRENCY, FEED_HOST_MIN_DELAY_SECONDS, FEED_HOST_BACKOFF_SECONDS, FEED_HOST_MAX_BACKOFF_SECONDS
+)
+from guid_hash import hash_guid, legacy_guid_hash
+from rate_limiter import HostRateLimiter
 
 logger = logging.getLogger(__name__)
 
-def parse_feed(feed_url: str) -> Optional[List[Dict]]:
+# Устанавливаем user-agent, чтобы избежать блокировок на некоторых сайтах
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+
+@dataclass
+class FeedFetchResult:
+    """Результат загрузки ленты."""
+    posts: List[Dict] = field(default_factory=list)
+    # True, если сервер ответил 304 или тело ответа не изменилось с прошлой проверки
+    not_modified: bool = False
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # Описание ошибки, если ленту не удалось загрузить или разобрать
+    error: Optional[str] = None
+    # Через сколько секунд можно повторить запрос, если сервер просил подождать (429/503)
+    retry_after: Optional[float] = None
+    # True, если сервер ограничил частоту запросов (429): такая проверка не считается отказом ленты,
+    # в отличие от 503, которым годами может отвечать и мертвый источник за CDN
+    throttled: bool = False
+    # True, если за проверку извлечены не все новые записи (FEED_MAX_ENTRIES_PER_CHECK):
+    # валидаторы такого ответа не сохраняются, иначе 304 или совпадение хеша скрыли бы остаток
+    truncated: bool = False
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+
+def _fetch_error(error: str, retry_after: Optional[float] = None, throttled: bool = False) -> FeedFetchResult:
+    return FeedFetchResult(error=error[:500], retry_after=retry_after, throttled=throttled)
+
+
+# Общий HTTP клиент с пулом keep-alive соединений (создается лениво в текущем event loop)
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий httpx.AsyncClient, создавая его при первом обращении."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            # Только сжатие, которое _download распаковывает с ограничением объема
+            headers={'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'},
+            timeout=httpx.Timeout(FEED_FETCH_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=FEED_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=FEED_HTTP_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            follow_redirects=True
+        )
+        logger.info("Создан общий HTTP клиент для загрузки лент.")
+    return _http_client
+
+
+async def close_http_client():
+    """Закрывает общий HTTP клиент (вызывается при остановке бота)."""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+        logger.info("Общий HTTP клиент для загрузки лент закрыт.")
+    _http_client = None
+
+
+# Ограничение запросов к одному хосту (общее для задачи проверки и ручной проверки лент)
+host_limiter = HostRateLimiter(FEED_HOST_MAX_CONCURRENCY, FEED_HOST_MIN_DELAY_SECONDS)
+
+
+def get_feed_host(feed_url: str) -> str:
+    """Хост ленты в нижнем регистре (ключ для ограничения запросов)."""
+    try:
+        return (urlsplit(feed_url.strip()).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+def _retry_after_seconds(value: Optional[str]) -> float:
+    """Пауза по заголовку Retry-After (секунды или HTTP-дата) в пределах FEED_HOST_MAX_BACKOFF_SECONDS."""
+    seconds = FEED_HOST_BACKOFF_SECONDS
+    if value:
+        value = value.strip()
+        if value.isdigit():
+            seconds = float(value)
+        else:
+            try:
+                retry_at = parsedate_to_datetime(value)
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    return min(FEED_HOST_MAX_BACKOFF_SECONDS, max(1.0, seconds))
+
+
+class _ResponseTooLarge(Exception):
+    """Тело ответа превышает FEED_MAX_RESPONSE_BYTES."""
+
+
+class _BoundedDecompressor:
     """
-    Парсит RSS-ленту и возвращает список словарей с данными постов.
+    Распаковывает тело в gzip или deflate по частям: за один шаг выдается не больше max_length байт,
+    поэтому превышение лимита замечается раньше, чем распакованный ответ целиком окажется в памяти.
+    """
+
+    def __init__(self, encoding: str):
+        # Часть серверов отдает deflate без zlib-заголовка: на первой ошибке пробуем "сырой" deflate
+        self._raw_deflate_fallback = encoding == 'deflate'
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS if encoding == 'deflate' else zlib.MAX_WBITS | 16)
+        self._started = False
+
+    @property
+    def unconsumed_tail(self) -> bytes:
+        return self._decompressor.unconsumed_tail
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        try:
+            output = self._decompressor.decompress(data, max_length)
+        except zlib.error:
+            if self._started or not self._raw_deflate_fallback:
+                raise
+            self._raw_deflate_fallback = False
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            output = self._decompressor.decompress(data, max_length)
+        self._started = True
+        return output
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush()
+
+
+def _make_decompressor(content_encoding: str) -> Optional[_BoundedDecompressor]:
+    """Возвращает распаковщик для Content-Encoding ответа или None для несжатого тела."""
+    encodings = [encoding.strip().lower() for encoding in content_encoding.split(',')]
+    encodings = [encoding for encoding in encodings if encoding and encoding != 'identity']
+    if not encodings:
+        return None
+    if len(encodings) == 1 and encodings[0] in ('gzip', 'x-gzip', 'deflate'):
+        return _BoundedDecompressor(encodings[0])
+    # Распаковщики brotli/zstd не умеют ограничивать объем за шаг, а мы их и не запрашиваем
+    raise httpx.DecodingError(f"Неподдерживаемое сжатие ответа: {content_encoding}")
+
+
+async def _download(client: httpx.AsyncClient, feed_url: str, headers: Dict[str, str]) -> Tuple[httpx.Response, bytes]:
+    """
+    Загружает ответ потоково и возвращает его вместе с телом (для статусов, кроме 200, тело не читается).
+    Загрузка прерывается, если Content-Length или уже полученный объем превышает FEED_MAX_RESPONSE_BYTES.
+    Сжатое тело распаковывается здесь же шагами, не превышающими остаток лимита,
+    поэтому gzip/deflate-бомба прерывается так же, как большой ответ.
+    """
+    async with client.stream('GET', feed_url, headers=headers) as response:
+        if response.status_code != 200:
+            return response, b''
+        content_length = response.headers.get('content-length', '')
+        if content_length.isdigit() and int(content_length) > FEED_MAX_RESPONSE_BYTES:
+            raise _ResponseTooLarge(f"Content-Length {content_length}")
+        decompressor = _make_decompressor(response.headers.get('content-encoding', ''))
+        chunks = []
+        size = 0
+
+        def append(chunk: bytes):
+            nonlocal size
+            size += len(chunk)
+            if size > FEED_MAX_RESPONSE_BYTES:
+                raise _ResponseTooLarge(f"больше {size} байт")
+            chunks.append(chunk)
+
+        try:
+            async for raw_chunk in response.aiter_raw():
+                if decompressor is None:
+                    append(raw_chunk)
+                    continue
+                while raw_chunk:
+                    append(decompressor.decompress(raw_chunk, FEED_MAX_RESPONSE_BYTES - size + 1))
+                    raw_chunk = decompressor.unconsumed_tail
+            if decompressor is not None:
+                append(decompressor.flush())
+        except zlib.error as e:
+            raise httpx.DecodingError(f"Ошибка распаковки ответа: {e}") from e
+        return response, b''.join(chunks)
+
+
+# Пул процессов для разбора больших лент (создается лениво)
+_parse_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_executor() -> Optional[ProcessPoolExecutor]:
+    """Возвращает пул процессов для разбора лент или None, если разбор в отдельных процессах отключен."""
+    global _parse_executor
+    if FEED_PARSE_PROCESSES <= 0:
+        return None
+    if _parse_executor is None:
+        # spawn вместо fork: основной процесс многопоточный (event loop, APScheduler, SQLAlchemy)
+        _parse_executor = ProcessPoolExecutor(
+            max_workers=FEED_PARSE_PROCESSES,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        logger.info(f"Создан пул из {FEED_PARSE_PROCESSES} процессов для разбора лент.")
+    return _parse_executor
+
+
+def shutdown_parse_executor():
+    """Останавливает пул процессов разбора лент (вызывается при остановке бота)."""
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Пул процессов для разбора лент остановлен.")
+    _parse_executor = None
+
+
+def _entry_time(entry):
+    """Время публикации (или обновления) записи в виде struct_time или None."""
+    return entry.get('published_parsed') or entry.get('updated_parsed')
+
+
+def _ordered_entries(entries: List) -> List:
+    """
+    Возвращает записи от новых к старым. Большинство лент уже отсортированы так,
+    но некоторые перечисляют записи от старых к новым - их достаточно развернуть,
+    сравнив даты первой и последней записи.
+    """
+    if len(entries) > 1:
+        first_time, last_time = _entry_time(entries[0]), _entry_time(entries[-1])
+        if first_time and last_time and first_time < last_time:
+            return entries[::-1]
+    return entries
+
+
+def _entry_to_post(entry, feed_url: str) -> Optional[Dict]:
+    """Преобразует запись feedparser в словарь поста; None, если у записи нет GUID и ссылки."""
+    # Получаем дату публикации
+    published_time = None
+    if hasattr(entry, 'published_parsed') and entry.published_parsed:
+        published_time = datetime.fromtimestamp(mktime(entry.published_parsed))
+    elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
+        published_time = datetime.fromtimestamp(mktime(entry.updated_parsed))
+    else:
+        # Если нет даты, используем текущее время (или можно пропустить пост)
+        published_time = datetime.now()
+        logger.warning(f"Не найдена дата публикации для поста '{entry.get('title', 'Без заголовка')}' в ленте {feed_url}. Используется текущее время.")
+
+    # Получаем уникальный идентификатор поста (guid или link)
+    guid = entry.get('guid', entry.get('link'))
+    if not guid:
+        logger.warning(f"Не найден GUID или link для поста '{entry.get('title', 'Без заголовка')}' в ленте {feed_url}. Пост будет пропущен.")
+        return None
+
+    return {
+        'title': entry.get('title', 'Без заголовка'),
+        'link': entry.get('link', ''),
+        'published': published_time,
+        'guid': guid,
+        'summary': entry.get('summary', entry.get('description', '')) # Иногда описание в description
+    }
+
+
+def _select_entries(feed_data, feed_url: str, known_guid_hashes: Optional[Set[bytes]] = None) -> Tuple[List, bool]:
+    """
+    Выбирает записи ленты для извлечения и возвращает (записи, извлечены ли не все новые записи).
+
+    Если переданы хеши недавно обработанных GUID ленты, записи перебираются от новых к старым,
+    уже известные пропускаются, а перебор останавливается после FEED_KNOWN_ENTRIES_TO_STOP
+    известных записей подряд: дальше в ленте идет история, которую не нужно конвертировать
+    и проверять по БД. Из новых записей выбираются не больше FEED_MAX_ENTRIES_PER_CHECK
+    самых старых; более новые остаются неизвестными и будут извлечены при следующих проверках.
+    """
+    if not known_guid_hashes or FEED_KNOWN_ENTRIES_TO_STOP <= 0:
+        return feed_data.entries, False
+
+    entries = _ordered_entries(feed_data.entries)
+    # Записи идут от новых к старым, поэтому при переполнении deque вытесняются самые новые
+    new_entries = deque(maxlen=FEED_MAX_ENTRIES_PER_CHECK)
+    new_count = 0
+    known_in_row = 0
+    for position, entry in enumerate(entries):
+        entry_guid = entry.get('guid', entry.get('link'))
+        if entry_guid and (hash_guid(entry_guid) in known_guid_hashes or legacy_guid_hash(entry_guid) in known_guid_hashes):
+            known_in_row += 1
+            if known_in_row >= FEED_KNOWN_ENTRIES_TO_STOP:
+                logger.debug(f"Инкрементальный разбор ленты {feed_url} остановлен на записи {position + 1} из {len(entries)}.")
+                break
+            continue
+        known_in_row = 0
+        new_entries.append(entry)
+        new_count += 1
+
+    truncated = new_count > len(new_entries)
+    if truncated:
+        logger.warning(f"В ленте {feed_url} {new_count} новых записей, за проверку извлекаются {len(new_entries)} самых старых, "
+                       f"остальные {new_count - len(new_entries)} будут извлечены при следующих проверках.")
+    return list(new_entries), truncated
+
+
+def iter_posts(feed_data, feed_url: str, known_guid_hashes: Optional[Set[bytes]] = None) -> Iterator[Dict]:
+    """
+    Лениво преобразует записи, распарсенные feedparser, в словари постов.
+    С хешами недавно обработанных GUID извлекаются только новые записи (см. _select_entries).
+    """
+    entries, _ = _select_entries(feed_data, feed_url, known_guid_hashes)
+    for entry in entries:
+        post = _entry_to_post(entry, feed_url)
+        if post is not None:
+            yield post
+
+
+def _parse_feed_content(content: bytes, response_headers: Dict[str, str], feed_url: str,
+                        known_guid_hashes: Optional[Set[bytes]] = None) -> Tuple[Optional[List[Dict]], bool, Optional[str]]:
+    """
+    Разбирает тело ленты и возвращает (посты, извлечены ли не все новые записи, None)
+    или (None, False, текст ошибки парсинга).
+    Функция уровня модуля: выполняется как в основном процессе, так и в пуле процессов,
+    откуда обратно передается только компактный список словарей постов.
+    """
+    feed_data = feedparser.parse(content, response_headers=response_headers)
+    # Проверка на ошибки парсинга
+    if feed_data.bozo:
+        # Можно добавить более детальную обработку разных типов ошибок bozo_exception
+        # Например, isinstance(bozo_exception, feedparser.CharacterEncodingOverride)
+        return None, False, str(feed_data.get('bozo_exception', 'Неизвестная ошибка'))
+    entries, truncated = _select_entries(feed_data, feed_url, known_guid_hashes)
+    posts = [post for post in (_entry_to_post(entry, feed_url) for entry in entries) if post is not None]
+    return posts, truncated, None
+
+
+async def _parse_content(content: bytes, response_headers: Dict[str, str], feed_url: str,
+                         known_guid_hashes: Optional[Set[bytes]] = None) -> Tuple[Optional[List[Dict]], bool, Optional[str]]:
+    """
+    Разбирает тело ленты: большие документы - в пуле процессов, чтобы разбор не занимал
+    event loop и использовал несколько ядер, небольшие - сразу в основном процессе.
+    """
+    executor = get_parse_executor() if len(content) >= FEED_PARSE_PROCESS_MIN_BYTES else None
+    if executor is not None:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, _parse_feed_content, content, response_headers, feed_url, known_guid_hashes
+            )
+        except BrokenProcessPool:
+            # Процесс пула аварийно завершился: пересоздаем пул при следующем обращении
+            logger.error(f"Пул процессов разбора лент поврежден при разборе {feed_url}, разбираю в основном процессе.")
+            shutdown_parse_executor()
+    return _parse_feed_content(content, response_headers, feed_url, known_guid_hashes)
+
+
+async def parse_feed(feed_url: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                     content_hash: Optional[str] = None,
+                     known_guid_hashes: Optional[Set[bytes]] = None) -> FeedFetchResult:
+    """
+    Загружает RSS-ленту через общий HTTP клиент и возвращает распарсенные посты.
+    Сетевой запрос не блокирует event loop, feedparser получает уже загруженные байты;
+    большие ленты разбираются в пуле процессов. Тело загружается потоково с ограничением размера
+    (FEED_MAX_RESPONSE_BYTES) и общего времени (FEED_FETCH_DEADLINE_SECONDS). Запросы к одному хосту ограничиваются
+    host_limiter, а после ответа 429/503 хост пропускается до истечения Retry-After.
+    Если переданы валидаторы прошлой загрузки, запрос делается условным (If-None-Match /
+    If-Modified-Since), а при ответе 304 или совпадении хеша тела парсинг пропускается.
 
     Args:
         feed_url: URL RSS-ленты.
+        etag: ETag из прошлого ответа.
+        last_modified: Last-Modified из прошлого ответа.
+        content_hash: SHA-256 тела прошлого ответа.
+        known_guid_hashes: хеши недавно обработанных GUID ленты; если переданы, возвращаются
+            только еще не известные посты, начиная с самых новых (см. iter_posts).
 
     Returns:
-        Список словарей, где каждый словарь представляет пост,
-        или None в случае ошибки парсинга.
+        FeedFetchResult со списком постов (или not_modified=True),
+        а в случае ошибки загрузки или парсинга - с описанием ошибки в error.
         Формат поста: {'title': str, 'link': str, 'published': datetime, 'guid': str, 'summary': str}
     """
     logger.info(f"Начинаю парсинг ленты: {feed_url}")
     try:
-        # Устанавливаем user-agent, чтобы избежать блокировок на некоторых сайтах
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        feed_data = feedparser.parse(feed_url, agent=headers['User-Agent'])
-
-        # Проверка на ошибки парсинга
-        if feed_data.bozo:
-            bozo_exception = feed_data.get('bozo_exception', 'Неизвестная ошибка')
-            logger.error(f"Ошибка парсинга ленты {feed_url}: {bozo_exception}")
-            # Можно добавить более детальную обработку разных типов ошибок bozo_exception
-            # Например, isinstance(bozo_exception, feedparser.CharacterEncodingOverride)
-            return None
-
-        if feed_data.status != 200 and feed_data.status != 301 and feed_data.status != 302:
-             logger.error(f"Ошибка при запросе ленты {feed_url}: HTTP статус {feed_data.status}")
-             return None
-
-
-        posts = []
-        for entry in feed_data.entries:
-            # Получаем дату публикации
-            published_time = None
-            if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                published_time = datetime.fromtimestamp(mktime(entry.published_parsed))
-            elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
-                published_time = datetime.fromtimestamp(mktime(entry.updated_parsed))
-            else:
-                # Если нет даты, используем текущее время (или можно пропустить пост)
-                published_time = datetime.now()
-                logger.warning(f"Не найдена дата публикации для поста '{entry.get('title', 'Без заголовка')}' в ленте {feed_url}. Используется текущее время.")
-
-            # Получаем уникальный идентификатор поста (guid или link)
-            guid = entry.get('guid', entry.get('link'))
-            if not guid:
-                logger.warning(f"Не найден GUID или link для поста '{entry.get('title', 'Без заголовка')}' в ленте {feed_url}. Пост будет пропущен.")
-                continue
-
-            post_data = {
-                'title': entry.get('title', 'Без заголовка'),
-                'link': entry.get('link', ''),
-                'published': published_time,
-                'guid': guid,
-                'summary': entry.get('summary', entry.get('description', '')) # Иногда описание в description
-            }
-            posts.append(post_data)
-
-        logger.info(f"Лента {feed_url} успешно распарсена, найдено {len(posts)} постов.")
-        return posts
+        request_headers = {}
+        if etag:
+            request_headers['If-None-Match'] = etag
+        if last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+
+        host = get_feed_host(feed_url)
+        client = get_http_client()
+        async with host_limiter.request(host):
+            # Пауза могла начаться, пока запрос ждал очереди к хосту
+            pause_left = host_limiter.pause_left(host)
+            if pause_left > 0:
+                logger.warning(f"Запросы к {host} приостановлены еще на {pause_left:.0f} с, лента {feed_url} пропущена.")
+                return _fetch_error(f"Запросы к {host} приостановлены сервером", retry_after=pause_left,
+                                    throttled=host_limiter.pause_status(host) == 429)
+            try:
+                response, content = await asyncio.wait_for(
+                    _download(client, feed_url, request_headers), FEED_FETCH_DEADLINE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"Лента {feed_url} не загрузилась за {FEED_FETCH_DEADLINE_SECONDS:g} с, загрузка прервана.")
+                return _fetch_error(f"Загрузка не уложилась в {FEED_FETCH_DEADLINE_SECONDS:g} с")
+            except _ResponseTooLarge as e:
+                logger.error(f"Лента {feed_url} больше {FEED_MAX_RESPONSE_BYTES} байт ({e}), загрузка прервана.")
+                return _fetch_error(f"Лента больше {FEED_MAX_RESPONSE_BYTES} байт")
+            except httpx.TimeoutException:
+                logger.error(f"Таймаут при запросе ленты {feed_url} ({FEED_FETCH_TIMEOUT_SECONDS} с).")
+                return _fetch_error(f"Таймаут ({FEED_FETCH_TIMEOUT_SECONDS:g} с)")
+            except httpx.HTTPError as e:
+                logger.error(f"Сетевая ошибка при запросе ленты {feed_url}: {e}")
+                return _fetch_error(f"Сетевая ошибка: {e}")
+
+        if response.status_code in (429, 503):
+            pause_seconds = _retry_after_seconds(response.headers.get('retry-after'))
+            host_limiter.pause(host, pause_seconds, response.status_code)
+            logger.warning(f"Хост {host} ответил HTTP {response.status_code} на {feed_url}, запросы к нему приостановлены на {pause_seconds:.0f} с.")
+            return _fetch_error(f"HTTP {response.status_code}", retry_after=pause_seconds, throttled=response.status_code == 429)
+
+        if response.status_code == 304:
+            logger.info(f"Лента {feed_url} не изменилась (HTTP 304).")
+            return FeedFetchResult(
+                not_modified=True,
+                etag=response.headers.get('etag', etag),
+                last_modified=response.headers.get('last-modified', last_modified),
+                content_hash=content_hash
+            )
+
+        if response.status_code != 200:
+            logger.error(f"Ошибка при запросе ленты {feed_url}: HTTP статус {response.status_code}")
+            return _fetch_error(f"HTTP {response.status_code}")
+
+        result = FeedFetchResult(
+            etag=response.headers.get('etag'),
+            last_modified=response.headers.get('last-modified'),
+            content_hash=hashlib.sha256(content).hexdigest()
+        )
+        if content_hash and result.content_hash == content_hash:
+            logger.info(f"Содержимое ленты {feed_url} не изменилось с прошлой проверки.")
+            result.not_modified = True
+            return result
+
+        # Передаем заголовки ответа, чтобы feedparser корректно определил кодировку и базовый URL
+        response_headers = dict(response.headers)
+        response_headers['content-location'] = str(response.url)
+        posts, truncated, parse_error = await _parse_content(content, response_headers, feed_url, known_guid_hashes)
+        if parse_error is not None:
+            logger.error(f"Ошибка парсинга ленты {feed_url}: {parse_error}")
+            return _fetch_error(f"Ошибка разбора: {parse_error}")
+
+        result.posts = posts
+        result.truncated = truncated
+        logger.info(f"Лента {feed_url} успешно распарсена, найдено {len(result.posts)} постов.")
+        return result
 
     except Exception as e:
         logger.error(f"Непредвиденная ошибка при парсинге ленты {feed_url}: {e}", exc_info=True)
-        return None
+        return _fetch_error(f"Непредвиденная ошибка: {e}")
 
 if __name__ == '__main__':
     # Пример использования
     logging.basicConfig(level=logging.INFO)
     # test_feed_url = "https://www.python.org/blogs/rss/" # Пример RSS
     test_feed_url = "http://static.feed.rbc.ru/rbc/logical/footer/news.rss" # Другой пример
-    parsed_posts = parse_feed(test_feed_url)
+
+    async def _main():
+        try:
+            return await parse_feed(test_feed_url)
+        finally:
+            await close_http_client()
+            shutdown_parse_executor()
+
+    fetch_result = asyncio.run(_main())
+    parsed_posts = None if fetch_result.failed else fetch_result.posts
     if parsed_posts:
         print(f"Найдено постов: {len(parsed_posts)}")
         for post in parsed_posts[:2]: # Печатаем первые 2 для примера
@@ -2,124 +2,356 @@
 import logging
 from datetime import datetime, timedelta, timezone
 import asyncio
-import html
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Set, Tuple
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from sqlalchemy.orm import Session
 from telegram import Bot
-from telegram.error import TelegramError, BadRequest
-from telegram.constants import ParseMode # Правильный импорт ParseMode
 
 # Локальные импорты
 from database import (
-    get_db, RSSFeed, Channel, ChannelFeedLink, ScheduledPost, # Модели
+    get_db, RSSFeed, # Модели
     get_subscriptions_for_feed,
-    add_published_post, is_post_published,
-    add_scheduled_post, get_pending_scheduled_posts, update_scheduled_post_status,
-    update_feed_last_checked
+    hash_guid, get_published_guids, get_recent_guid_hashes, add_published_posts, add_scheduled_posts,
+    update_feed_check_schedule, update_feed_validators, get_due_feeds, get_feeds_by_source_urls, normalize_feed_url,
+    get_feed_check_bounds, get_feed_check_interval, mark_feeds_half_open,
+    delete_old_scheduled_posts, delete_old_published_posts, delete_orphaned_posts, compact_database
+)
+from rss_parser import parse_feed, get_feed_host, host_limiter, FeedFetchResult
+from guid_cache import seen_guid_cache
+from publisher import start_publisher, stop_publisher, notify_publisher
+from config import (
+    FEED_CHECK_CONCURRENCY, FEED_CHECK_BATCH_SIZE, FEED_RECENT_GUIDS_LIMIT, FEED_RATE_SMOOTHING,
+    FEED_CIRCUIT_FAILURE_THRESHOLD, FEED_CIRCUIT_OPEN_MINUTES, FEED_CIRCUIT_MAX_OPEN_HOURS,
+    MAINTENANCE_INTERVAL_HOURS, MAINTENANCE_BATCH_SIZE, MAINTENANCE_VACUUM,
+    SCHEDULED_POSTS_RETENTION_DAYS, PUBLISHED_POSTS_RETENTION_DAYS, PUBLISHED_POSTS_KEEP_PER_FEED
 )
-from rss_parser import parse_feed # Убрали FeedEntry
-# from config import BOT_MODE # BOT_MODE здесь не используется
 
 logger = logging.getLogger(__name__)
 
-# --- Форматирование и отправка ---
+# --- Задачи планировщика ---
+
+async def process_single_feed(bot: Bot, db: Session, feed: RSSFeed):
+    """
+    Обрабатывает одну RSS-ленту (ручная проверка): парсит, находит новые посты, добавляет их
+    в очередь ScheduledPost и обновляет расписание ленты так же, как задача проверки.
+    Для приостановленной ленты ручная проверка считается пробной: успех снимает приостановку,
+    неудача продлевает ее.
+    """
+    logger.info(f"Начинаю проверку ленты ID {feed.id}: {feed.url}")
+    if feed.circuit_state == 'open':
+        mark_feeds_half_open(db, [feed.id])
+        db.refresh(feed)
+    known_guid_hashes = get_seen_guid_hashes(db, feed.id)
+    fetch_result = await parse_feed(feed.url, etag=feed.etag, last_modified=feed.last_modified, content_hash=feed.content_hash,
+                                    known_guid_hashes=known_guid_hashes)
+    apply_and_schedule(db, feed, fetch_result)
+
+
+def apply_fetch_result(db: Session, feed: RSSFeed, fetch_result: FeedFetchResult) -> Optional[int]:
+    """
+    Применяет результат загрузки ленты: при 304 или неизменном теле только обновляет валидаторы,
+    иначе сохраняет посты. Работает только с БД (без сетевых запросов),
+    поэтому сессия не удерживается во время загрузки.
+    Возвращает число новых постов или None, если ленту не удалось загрузить или посты не удалось сохранить:
+    в обоих случаях проверка считается неудачной и повторяется по расписанию неудач.
+    """
+    if fetch_result.failed:
+        logger.warning(f"Не удалось получить посты для ленты ID {feed.id}: {feed.url} ({fetch_result.error})")
+        return None
+    # Общий для нескольких лент запрос мог быть безусловным, поэтому сверяем и собственный хеш ленты
+    if fetch_result.not_modified or (feed.content_hash and feed.content_hash == fetch_result.content_hash):
+        logger.info(f"Лента ID {feed.id} не изменилась с прошлой проверки, обработка постов пропущена.")
+        update_feed_validators(db, feed.id, fetch_result.etag, fetch_result.last_modified, fetch_result.content_hash)
+        return 0
+    # Валидаторы сохраняем только после успешной записи постов, иначе при ошибке посты были бы потеряны.
+    # Если извлечены не все новые записи, не сохраняем их вовсе: остаток ленты разбирается при следующей проверке
+    new_posts_count = store_parsed_posts(db, feed, fetch_result.posts)
+    if new_posts_count is None:
+        return None
+    if not fetch_result.truncated:
+        update_feed_validators(db, feed.id, fetch_result.etag, fetch_result.last_modified, fetch_result.content_hash)
+    return new_posts_count
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite возвращает даты без часового пояса, хранятся они в UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _estimate_posts_per_hour(posts: List[Dict]) -> Optional[float]:
+    """Оценивает частоту публикаций по датам постов ленты (нужно хотя бы два поста с разными датами)."""
+    published = [post_data['published'] for post_data in posts if post_data.get('published')]
+    if len(published) < 2:
+        return None
+    span_hours = (max(published) - min(published)).total_seconds() / 3600
+    return (len(published) - 1) / span_hours if span_hours > 0 else None
+
+
+@dataclass
+class FeedCheckSchedule:
+    """Расписание ленты после проверки."""
+    interval_minutes: float
+    # Через сколько минут проверить снова (для приостановленной ленты - длительность приостановки)
+    next_check_in_minutes: float
+    posts_per_hour: Optional[float]
+    consecutive_failures: int = 0
+    circuit_state: str = 'closed'
+    last_error: Optional[str] = None
+
+
+def compute_check_schedule(feed: RSSFeed, fetch_result: FeedFetchResult, new_posts_count: Optional[int],
+                           now: datetime) -> FeedCheckSchedule:
+    """
+    Рассчитывает расписание ленты после проверки. Частота публикаций оценивается скользящим средним
+    числа новых постов за прошедший интервал (первая оценка - по датам постов в ленте),
+    а интервал подбирается так, чтобы за проверку появлялся примерно один новый пост:
+    активные ленты проверяются чаще, тихие - реже, но не более чем вдвое реже за один шаг
+    и всегда в границах ленты.
+
+    Неудачные проверки подряд откладывают следующую попытку экспоненциально (до верхней границы),
+    не меняя найденный интервал. После FEED_CIRCUIT_FAILURE_THRESHOLD неудач лента приостанавливается
+    (circuit 'open') на FEED_CIRCUIT_OPEN_MINUTES с удвоением на каждую следующую неудачу;
+    по окончании приостановки выполняется одна пробная проверка ('half_open'): успех возвращает
+    ленту к обычным проверкам, неудача - снова приостанавливает ее на больший срок.
+    Ограничение частоты запросов (429) неудачей ленты не считается; 503 считается, но следующая
+    попытка в любом случае не раньше Retry-After.
+    """
+    min_minutes, max_minutes = get_feed_check_bounds(feed)
+    interval = get_feed_check_interval(feed)
+    failures = feed.consecutive_failures or 0
+    # Загрузка могла пройти успешно, а упасть сохранение постов
+    last_error = fetch_result.error or "Не удалось сохранить посты ленты"
+    retry_after_minutes = (fetch_result.retry_after or 0) / 60
+    if fetch_result.failed and fetch_result.throttled:
+        return FeedCheckSchedule(interval, max(interval, retry_after_minutes), feed.posts_per_hour,
+                                 failures, feed.circuit_state or 'closed', last_error)
+    if new_posts_count is None:
+        failures += 1
+        if feed.circuit_state == 'half_open' or failures >= FEED_CIRCUIT_FAILURE_THRESHOLD:
+            suspension = FEED_CIRCUIT_OPEN_MINUTES * 2 ** min(max(0, failures - FEED_CIRCUIT_FAILURE_THRESHOLD), 16)
+            suspension = max(retry_after_minutes, min(FEED_CIRCUIT_MAX_OPEN_HOURS * 60, suspension))
+            return FeedCheckSchedule(interval, suspension, feed.posts_per_hour, failures, 'open', last_error)
+        retry_in = max(retry_after_minutes, min(max_minutes, interval * 2 ** min(failures - 1, 10)))
+        return FeedCheckSchedule(interval, retry_in, feed.posts_per_hour, failures, 'closed', last_error)
+
+    elapsed_hours = max(1 / 60, (now - _as_utc(feed.last_checked)).total_seconds() / 3600) if feed.last_checked else interval / 60
+    observed_rate = new_posts_count / elapsed_hours
+    if feed.posts_per_hour is None:
+        posts_per_hour = _estimate_posts_per_hour(fetch_result.posts)
+        if posts_per_hour is None:
+            posts_per_hour = observed_rate
+    else:
+        posts_per_hour = FEED_RATE_SMOOTHING * observed_rate + (1 - FEED_RATE_SMOOTHING) * feed.posts_per_hour
+
+    target = 60 / posts_per_hour if posts_per_hour > 0 else max_minutes
+    interval = min(max_minutes, max(min_minutes, min(target, interval * 2)))
+    return FeedCheckSchedule(interval, interval, posts_per_hour)
+
+
+def _update_check_schedule(db: Session, feed: RSSFeed, fetch_result: FeedFetchResult, new_posts_count: Optional[int]):
+    previous_state = feed.circuit_state
+    schedule = compute_check_schedule(feed, fetch_result, new_posts_count, datetime.now(timezone.utc))
+    if schedule.circuit_state == 'open':
+        logger.warning(f"Лента ID {feed.id} ({feed.url}) приостановлена на {schedule.next_check_in_minutes:.0f} мин "
+                       f"после {schedule.consecutive_failures} неудачных проверок подряд: {schedule.last_error}")
+    elif previous_state == 'half_open' and schedule.circuit_state == 'closed':
+        logger.info(f"Пробная проверка ленты ID {feed.id} успешна, лента снова проверяется в обычном режиме.")
+    elif schedule.consecutive_failures:
+        logger.info(f"Лента ID {feed.id}: неудачных проверок подряд {schedule.consecutive_failures}, "
+                    f"следующая попытка через {schedule.next_check_in_minutes:.0f} мин.")
+    elif fetch_result.failed:
+        logger.info(f"Лента ID {feed.id}: сервер просит подождать ({schedule.last_error}), "
+                    f"следующая проверка через {schedule.next_check_in_minutes:.0f} мин.")
+    else:
+        # У ленты без постов с датами оценки частоты еще может не быть
+        logger.debug(f"Лента ID {feed.id}: интервал проверки {schedule.interval_minutes:.0f} мин, "
+                     f"оценка {schedule.posts_per_hour or 0:.2f} постов/ч.")
+    update_feed_check_schedule( # Эта функция сама коммитит
+        db, feed.id, schedule.interval_minutes, schedule.next_check_in_minutes, schedule.posts_per_hour,
+        schedule.consecutive_failures, schedule.circuit_state, schedule.last_error
+    )
 
-def format_scheduled_message(scheduled_post: ScheduledPost) -> str:
-    """Форматирует отложенный пост для отправки в Telegram."""
-    title = html.escape(scheduled_post.post_title or 'Без заголовка')
-    link = scheduled_post.post_link or ''
-    summary_html = scheduled_post.post_summary or ''
-    hashtags = scheduled_post.hashtags or ''
 
-    message = f"<b>{title}</b>\n\n"
-    if summary_html:
-        message += f"{summary_html}\n\n"
-    if link:
-        message += f'\n<a href="{link}">Источник</a>'
-    if hashtags:
-        message += f"\n\n{html.escape(hashtags)}"
+def apply_and_schedule(db: Session, feed: RSSFeed, fetch_result: FeedFetchResult):
+    """Применяет результат загрузки ленты и пересчитывает ее расписание (общий путь плановой и ручной проверки)."""
+    new_posts_count = apply_fetch_result(db, feed, fetch_result)
+    _update_check_schedule(db, feed, fetch_result, new_posts_count)
 
-    MAX_MESSAGE_LENGTH = 4096
-    if len(message) > MAX_MESSAGE_LENGTH:
-         message = message[:MAX_MESSAGE_LENGTH - 4] + "..."
 
-    return message
+def get_seen_guid_hashes(db: Session, feed_id: int) -> Set[bytes]:
+    """
+    Возвращает хеши недавно обработанных GUID ленты из кеша процесса,
+    при первом обращении (или после вытеснения) загружая последние из published_posts.
+    """
+    known_guid_hashes = seen_guid_cache.get(feed_id)
+    if known_guid_hashes is None:
+        known_guid_hashes = get_recent_guid_hashes(db, feed_id, FEED_RECENT_GUIDS_LIMIT)
+        seen_guid_cache.add(feed_id, known_guid_hashes)
+    return known_guid_hashes
 
-# --- Задачи планировщика ---
 
-async def process_single_feed(bot: Bot, db: Session, feed: RSSFeed):
+def _select_new_posts(db: Session, feed: RSSFeed, parsed_posts: List[Dict]) -> List[Dict]:
     """
-    Обрабатывает одну RSS-ленту: парсит, находит новые посты и добавляет их в очередь ScheduledPost.
+    Возвращает посты, которые еще не обрабатывались для ленты, от старых к новым.
+    Сначала отсеиваются GUID из кеша процесса, остальные проверяются по БД пакетно,
+    без отдельного запроса на каждый пост.
     """
-    logger.info(f"Начинаю проверку ленты ID {feed.id}: {feed.url}")
-    parsed_posts = parse_feed(feed.url)
+    posts_with_guid = []
+    published_guids = set()
+    for post_data in parsed_posts:
+        if not post_data.get('guid'):
+            logger.warning(f"Пост в ленте {feed.id} без GUID, пропущен: {post_data.get('title')}")
+        elif seen_guid_cache.contains(feed.id, hash_guid(post_data['guid'])):
+            published_guids.add(post_data['guid'])
+        else:
+            posts_with_guid.append(post_data)
+
+    if posts_with_guid:
+        db_published_guids = get_published_guids(db, feed.id, [post_data['guid'] for post_data in posts_with_guid])
+        seen_guid_cache.add(feed.id, (hash_guid(guid) for guid in db_published_guids))
+        published_guids.update(db_published_guids)
+    new_posts = []
+    seen_guids = set(published_guids)
+    for post_data in reversed(posts_with_guid):
+        guid = post_data['guid']
+        if guid in seen_guids:
+            continue
+        seen_guids.add(guid) # Лента может содержать один и тот же GUID несколько раз
+        new_posts.append(post_data)
+    return new_posts
+
 
-    if parsed_posts is None:
-        logger.warning(f"Не удалось получить посты для ленты ID {feed.id}: {feed.url}")
-        return
+def store_parsed_posts(db: Session, feed: RSSFeed, parsed_posts: List[Dict]) -> Optional[int]:
+    """
+    Отмечает новые посты ленты как обработанные и добавляет их в очередь ScheduledPost
+    для всех подписок ленты одной транзакцией. Возвращает число новых постов
+    или None, если изменения не удалось сохранить.
+    """
     if not parsed_posts:
         logger.info(f"Постов не найдено в ленте ID {feed.id}: {feed.url}")
-        return
+        return 0
+
+    new_posts = _select_new_posts(db, feed, parsed_posts)
+    if not new_posts:
+        logger.info(f"Новых необработанных постов не найдено для ленты {feed.id}.")
+        return 0
 
     subscriptions = get_subscriptions_for_feed(db, feed.id)
     if not subscriptions:
         logger.info(f"Нет подписок для ленты ID {feed.id}.")
-        posts_marked = 0
-        for post_data in parsed_posts:
-            guid = post_data.get('guid')
-            if guid and not is_post_published(db, feed.id, guid):
-                if add_published_post(db, feed.id, guid):
-                    posts_marked += 1
-        if posts_marked > 0:
-            try:
-                db.commit()
-                logger.info(f"Отмечено {posts_marked} новых постов как обработанные для ленты {feed.id} (нет подписок).")
-            except Exception as e:
-                logger.error(f"Ошибка commit при отметке постов для ленты {feed.id} (нет подписок): {e}")
-                db.rollback()
-        return
+        add_published_posts(db, feed.id, [post_data['guid'] for post_data in new_posts])
+        try:
+            db.commit()
+            logger.info(f"Отмечено {len(new_posts)} новых постов как обработанные для ленты {feed.id} (нет подписок).")
+        except Exception as e:
+            logger.error(f"Ошибка commit при отметке постов для ленты {feed.id} (нет подписок): {e}")
+            db.rollback()
+            return None
+        seen_guid_cache.add(feed.id, (hash_guid(post_data['guid']) for post_data in new_posts))
+        return len(new_posts)
+
+    logger.info(f"Лента ID {feed.id} ({feed.url}): Найдено {len(parsed_posts)} постов, из них новых {len(new_posts)}. Подписок: {len(subscriptions)}.")
+
+    scheduled_time = datetime.now(timezone.utc) + timedelta(minutes=feed.publish_delay_minutes)
+    for post_data in new_posts:
+        logger.info(f"Найден новый необработанный пост в ленте {feed.id}: GUID={post_data['guid']}, Title={post_data.get('title')}")
+    add_published_posts(db, feed.id, [post_data['guid'] for post_data in new_posts])
+    new_posts_scheduled = add_scheduled_posts(db, feed.id, scheduled_time, new_posts, subscriptions)
+    try:
+        db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка commit при добавлении постов ленты {feed.id} в очередь: {e}")
+        db.rollback()
+        return None
+    # В кеш попадают только сохраненные GUID, иначе после rollback посты были бы пропущены навсегда
+    seen_guid_cache.add(feed.id, (hash_guid(post_data['guid']) for post_data in new_posts))
+
+    logger.info(f"Добавлено {new_posts_scheduled} постов в очередь для ленты {feed.id}.")
+    notify_publisher()
+    return len(new_posts)
+
+
+def get_known_guid_hashes(feed_ids: List[int]) -> Set[bytes]:
+    """
+    Возвращает хеши GUID, недавно обработанных всеми лентами источника: парсер пропускает
+    только такие записи, поэтому новая для любой из лент запись не будет потеряна.
+    """
+    known_guid_hashes: Optional[Set[bytes]] = None
+    with next(get_db()) as db:
+        for feed_id in feed_ids:
+            feed_hashes = get_seen_guid_hashes(db, feed_id)
+            known_guid_hashes = feed_hashes if known_guid_hashes is None else known_guid_hashes & feed_hashes
+            if not known_guid_hashes:
+                break
+    return known_guid_hashes or set()
 
-    logger.info(f"Лента ID {feed.id} ({feed.url}): Найдено {len(parsed_posts)} постов. Подписок: {len(subscriptions)}.")
 
-    new_posts_scheduled = 0
-    now = datetime.now(timezone.utc)
+def group_feeds_by_source(feeds: List[RSSFeed]) -> Dict[str, List[RSSFeed]]:
+    """
+    Группирует ленты по нормализованному URL: в public режиме одну и ту же ленту
+    добавляют многие пользователи, а загружать и парсить ее достаточно один раз за цикл.
+    """
+    sources: Dict[str, List[RSSFeed]] = {}
+    for feed in feeds:
+        sources.setdefault(feed.source_url or normalize_feed_url(feed.url), []).append(feed)
+    return sources
 
-    for post_data in reversed(parsed_posts):
-        guid = post_data.get('guid')
-        if not guid:
-            logger.warning(f"Пост в ленте {feed.id} без GUID, пропущен: {post_data.get('title')}")
-            continue
 
-        if not is_post_published(db, feed.id, guid):
-            logger.info(f"Найден новый необработанный пост в ленте {feed.id}: GUID={guid}, Title={post_data.get('title')}")
-            add_published_post(db, feed.id, guid)
-            scheduled_time = now + timedelta(minutes=feed.publish_delay_minutes)
-
-            for sub in subscriptions:
-                added = add_scheduled_post(
-                    db_session=db,
-                    feed_id=feed.id,
-                    channel_id=sub.channel_id,
-                    post_guid=guid,
-                    scheduled_time=scheduled_time,
-                    post_data=post_data,
-                    hashtags=sub.hashtags,
-                    user_id=sub.user_id
-                )
-                if added:
-                    new_posts_scheduled += 1
+def interleave_sources_by_host(sources: Dict[str, List[RSSFeed]]) -> List[Tuple[str, List[RSSFeed]]]:
+    """
+    Упорядочивает источники по кругу между хостами (a1, b1, c1, a2, b2, ...): места в общем
+    лимите параллельности достаются разным хостам, а не ленты одного сайта ждут друг друга,
+    занимая все слоты, пока host_limiter разносит их запросы по времени.
+    """
+    by_host: Dict[str, List[Tuple[str, List[RSSFeed]]]] = {}
+    for source_url, source_feeds in sources.items():
+        by_host.setdefault(get_feed_host(source_url), []).append((source_url, source_feeds))
+    ordered = []
+    host_queues = list(by_host.values())
+    for position in range(max((len(queue) for queue in host_queues), default=0)):
+        ordered.extend(queue[position] for queue in host_queues if position < len(queue))
+    return ordered
+
+
+async def _check_feed_source(bot: Bot, source_url: str, due_feeds: List[RSSFeed], semaphore: asyncio.Semaphore) -> int:
+    """
+    Загружает один источник (URL) и раздает результат всем лентам-владельцам.
+    Загрузка идет без открытой сессии (due_feeds - отсоединенные от сессии снимки строк),
+    а сохранение для каждой ленты - в собственной сессии, чтобы ошибки и rollback
+    не затрагивали другие ленты. Возвращает число обработанных лент.
+    """
+    # Условный запрос возможен, только если все ленты источника помнят одну и ту же версию
+    validators = {(feed.etag, feed.last_modified, feed.content_hash) for feed in due_feeds}
+    etag, last_modified, content_hash = validators.pop() if len(validators) == 1 else (None, None, None)
+
+    async with semaphore:
+        feed_ids = [feed.id for feed in due_feeds]
+        logger.info(f"Время проверки для лент ID {feed_ids} ({source_url}).")
+        try:
+            fetch_result = await parse_feed(
+                due_feeds[0].url, etag=etag, last_modified=last_modified, content_hash=content_hash,
+                known_guid_hashes=get_known_guid_hashes(feed_ids)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке источника {source_url}: {e}", exc_info=True)
+            return 0
+
+        checked_count = 0
+        for feed_id in feed_ids:
             try:
-                db.commit()
+                with next(get_db()) as db:
+                    feed = db.query(RSSFeed).filter(RSSFeed.id == feed_id).first()
+                    if not feed:
+                        logger.info(f"Лента ID {feed_id} была удалена во время проверки.")
+                        continue
+                    apply_and_schedule(db, feed, fetch_result)
+                checked_count += 1
             except Exception as e:
-                logger.error(f"Ошибка commit при добавлении поста {guid} (feed_id={feed.id}) в очередь: {e}")
-                db.rollback()
-
-    if new_posts_scheduled > 0:
-        logger.info(f"Добавлено {new_posts_scheduled} постов в очередь для ленты {feed.id}.")
-    else:
-        logger.info(f"Новых необработанных постов не найдено для ленты {feed.id}.")
+                logger.error(f"Ошибка при полной обработке ленты ID {feed_id}: {e}", exc_info=True)
+        return checked_count
 
 
 async def check_all_feeds_job(context):
@@ -127,88 +359,100 @@ async def check_all_feeds_job(context):
     bot: Bot = context.bot
     logger.info("Запуск задачи проверки RSS лент...")
     start_time = datetime.now()
-    checked_count = 0
 
     with next(get_db()) as db:
-        all_feeds_in_db = db.query(RSSFeed).all()
-        if not all_feeds_in_db:
-            logger.info("Нет RSS лент в базе данных для проверки.")
+        due_feeds = get_due_feeds(db, datetime.now(timezone.utc), FEED_CHECK_BATCH_SIZE)
+        if not due_feeds:
+            logger.info("Нет RSS лент, ожидающих проверки.")
             return
-
-        logger.info(f"Найдено {len(all_feeds_in_db)} лент в БД для потенциальной проверки.")
-        now = datetime.now(timezone.utc)
-
-        for feed in all_feeds_in_db:
-            last_checked_aware = feed.last_checked.replace(tzinfo=timezone.utc) if feed.last_checked and feed.last_checked.tzinfo is None else feed.last_checked
-            should_check = not last_checked_aware or now >= (last_checked_aware + timedelta(minutes=feed.update_interval_minutes))
-
-            if should_check:
-                logger.info(f"Время проверки для ленты ID {feed.id} ({feed.url}).")
-                try:
-                    await process_single_feed(bot, db, feed)
-                    update_feed_last_checked(db, feed.id) # Эта функция сама коммитит
-                    checked_count += 1
-                except Exception as e:
-                    logger.error(f"Ошибка при полной обработке ленты ID {feed.id}: {e}", exc_info=True)
-                    db.rollback()
-            # else:
-            #      logger.debug(f"Пропуск проверки ленты ID {feed.id}. Следующая проверка не раньше {next_check_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+        logger.info(f"Найдено {len(due_feeds)} лент, ожидающих проверки (лимит {FEED_CHECK_BATCH_SIZE}).")
+        # Ленты других пользователей с теми же источниками проверяются вместе с ними, даже если их время
+        # еще не наступило: иначе из-за разных расписаний строк один URL загружался бы отдельно для каждой
+        sources = group_feeds_by_source(due_feeds)
+        companion_feeds = get_feeds_by_source_urls(db, list(sources), exclude_ids=[feed.id for feed in due_feeds])
+        if companion_feeds:
+            logger.info(f"Вместе с ними проверяются {len(companion_feeds)} лент с теми же источниками.")
+            due_feeds.extend(companion_feeds)
+            sources = group_feeds_by_source(due_feeds)
+        suspended_feed_ids = [feed.id for feed in due_feeds if feed.circuit_state == 'open']
+        # Загруженные атрибуты остаются доступны после закрытия сессии
+        db.expunge_all()
+        # Приостановка закончилась: проверка этих лент будет пробной
+        if mark_feeds_half_open(db, suspended_feed_ids):
+            logger.info(f"Пробная проверка приостановленных лент ID {suspended_feed_ids}.")
+
+    # Источники загружаются и парсятся параллельно, не более FEED_CHECK_CONCURRENCY одновременно,
+    # запросы к одному хосту дополнительно ограничиваются и разносятся по времени в parse_feed
+    semaphore = asyncio.Semaphore(FEED_CHECK_CONCURRENCY)
+    results = await asyncio.gather(*(
+        _check_feed_source(bot, source_url, source_feeds, semaphore)
+        for source_url, source_feeds in interleave_sources_by_host(sources)
+    ))
+    checked_count = sum(results)
+    host_limiter.prune()
 
     duration = datetime.now() - start_time
-    logger.info(f"Задача проверки RSS лент завершена. Проверено {checked_count} лент. Длительность: {duration}.")
+    logger.info(f"Задача проверки RSS лент завершена. Проверено {checked_count} из {len(due_feeds)} лент ({len(sources)} уникальных URL). Длительность: {duration}.")
 
 
-async def publish_scheduled_posts_job(context):
-    """Задача: публикация отложенных постов."""
-    bot: Bot = context.bot
-    logger.info("Запуск задачи публикации отложенных постов...")
-    published_count = 0
-    failed_count = 0
-
-    with next(get_db()) as db:
-        posts_to_publish = get_pending_scheduled_posts(db)
-        if not posts_to_publish:
-            logger.info("Нет отложенных постов для публикации.")
-            return
-        logger.info(f"Найдено {len(posts_to_publish)} отложенных постов для публикации.")
-
-        for scheduled_post in posts_to_publish:
-            channel = db.query(Channel).filter(Channel.id == scheduled_post.channel_id).first()
-            if not channel:
-                logger.error(f"Не найден канал (внутр. ID {scheduled_post.channel_id}) для отложенного поста ID {scheduled_post.id}. Помечаем как failed.")
-                update_scheduled_post_status(db, scheduled_post.id, "failed")
-                failed_count += 1
-                continue
-
-            message_text = format_scheduled_message(scheduled_post)
-            status = "published"
+async def _delete_in_batches(delete_batch, description: str) -> int:
+    """
+    Вызывает delete_batch(db) до тех пор, пока он удаляет полные пачки.
+    Каждая пачка - отдельная короткая транзакция, между пачками управление отдается event loop.
+    """
+    total_deleted = 0
+    while True:
+        with next(get_db()) as db:
             try:
-                await bot.send_message(chat_id=channel.chat_id, text=message_text, parse_mode=ParseMode.HTML, disable_web_page_preview=False)
-                logger.info(f"Отложенный пост ID {scheduled_post.id} (GUID: {scheduled_post.post_guid}) успешно отправлен в канал {channel.chat_id}.")
-                published_count += 1
-            except BadRequest as e:
-                 logger.error(f"Ошибка BadRequest при отправке отложенного поста ID {scheduled_post.id} в канал {channel.chat_id}: {e}")
-                 status = "failed"
-                 failed_count += 1
-            except TelegramError as e:
-                logger.error(f"Ошибка Telegram при отправке отложенного поста ID {scheduled_post.id} в канал {channel.chat_id}: {e}")
-                status = "failed"
-                failed_count += 1
+                deleted = delete_batch(db)
+                db.commit()
             except Exception as e:
-                logger.error(f"Непредвиденная ошибка при отправке отложенного поста ID {scheduled_post.id} в канал {channel.chat_id}: {e}", exc_info=True)
-                status = "failed"
-                failed_count += 1
+                logger.error(f"Ошибка очистки ({description}): {e}", exc_info=True)
+                db.rollback()
+                break
+        total_deleted += deleted
+        if deleted < MAINTENANCE_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+    return total_deleted
 
-            update_scheduled_post_status(db, scheduled_post.id, status)
-            await asyncio.sleep(0.2) # Пауза
 
-        try:
-            db.commit() # Коммитим все изменения статусов
-        except Exception as e:
-            logger.error(f"Ошибка commit при обновлении статусов отложенных постов: {e}")
-            db.rollback()
+async def maintenance_job(context):
+    """Задача: удаление старой истории отложенных и опубликованных постов и сжатие БД."""
+    logger.info("Запуск задачи обслуживания базы данных...")
+    start_time = datetime.now()
+    now = datetime.now(timezone.utc)
+
+    deleted_orphans = await _delete_in_batches(
+        lambda db: delete_orphaned_posts(db, MAINTENANCE_BATCH_SIZE), "записи удаленных лент и каналов"
+    )
 
-    logger.info(f"Задача публикации отложенных постов завершена. Опубликовано: {published_count}, Ошибок: {failed_count}.")
+    deleted_scheduled = 0
+    if SCHEDULED_POSTS_RETENTION_DAYS:
+        scheduled_cutoff = now - timedelta(days=SCHEDULED_POSTS_RETENTION_DAYS)
+        deleted_scheduled = await _delete_in_batches(
+            lambda db: delete_old_scheduled_posts(db, scheduled_cutoff, MAINTENANCE_BATCH_SIZE), "отложенные посты"
+        )
+
+    deleted_published = 0
+    if PUBLISHED_POSTS_RETENTION_DAYS:
+        published_cutoff = now - timedelta(days=PUBLISHED_POSTS_RETENTION_DAYS)
+        deleted_published = await _delete_in_batches(
+            lambda db: delete_old_published_posts(db, published_cutoff, PUBLISHED_POSTS_KEEP_PER_FEED, MAINTENANCE_BATCH_SIZE),
+            "опубликованные посты"
+        )
+
+    logger.info(f"Удалено записей: отложенных постов {deleted_scheduled}, опубликованных постов {deleted_published}, "
+                f"записей удаленных лент и каналов {deleted_orphans}.")
+
+    try:
+        # VACUUM и ANALYZE блокируют поток на время выполнения, поэтому выполняются вне event loop
+        await asyncio.to_thread(compact_database, MAINTENANCE_VACUUM)
+    except Exception as e:
+        logger.error(f"Ошибка сжатия базы данных: {e}", exc_info=True)
+
+    duration = datetime.now() - start_time
+    logger.info(f"Задача обслуживания базы данных завершена. Длительность: {duration}.")
 
 
 # --- Управление планировщиком ---
@@ -216,7 +460,7 @@ async def publish_scheduled_posts_job(context):
 scheduler = AsyncIOScheduler(timezone="UTC")
 
 def start_scheduler(application):
-    """Инициализирует и запускает планировщик с двумя задачами."""
+    """Инициализирует и запускает планировщик проверки лент и фоновый публикатор."""
     if not scheduler.running:
         scheduler.add_job(
             check_all_feeds_job,
@@ -227,22 +471,26 @@ def start_scheduler(application):
             args=[application]
         )
         scheduler.add_job(
-            publish_scheduled_posts_job,
-            trigger=IntervalTrigger(minutes=1),
-            id="publish_scheduled_posts_job",
-            name="Публикация отложенных постов",
+            maintenance_job,
+            trigger=IntervalTrigger(hours=MAINTENANCE_INTERVAL_HOURS),
+            id="maintenance_job",
+            name="Очистка истории постов",
             replace_existing=True,
             args=[application]
         )
 
         scheduler.start()
-        logger.info("Планировщик запущен. Добавлены задачи: проверка лент (5 мин), публикация отложенных (1 мин).")
+        # Публикация отложенных постов - не периодическая задача, а фоновый цикл, который
+        # спит до ближайшего scheduled_time и будится при добавлении постов в очередь
+        start_publisher(application.bot)
+        logger.info(f"Планировщик запущен. Добавлены задачи: проверка лент (5 мин), очистка истории ({MAINTENANCE_INTERVAL_HOURS:g} ч), фоновая публикация отложенных постов.")
     else:
         logger.warning("Планировщик уже запущен.")
     return scheduler
 
 def stop_scheduler():
     """Останавливает планировщик."""
+    stop_publisher()
     if scheduler.running:
         scheduler.shutdown()
         logger.info("Планировщик остановлен.")
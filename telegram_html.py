@@ -0,0 +1,277 @@
+# telegram_html.py
+import html
+import re
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Теги, которые Telegram понимает в parse_mode=HTML (синонимы приводятся к одному имени)
+ALLOWED_TAGS = {
+    'b': 'b', 'strong': 'b',
+    'i': 'i', 'em': 'i',
+    'u': 'u', 'ins': 'u',
+    's': 's', 'strike': 's', 'del': 's',
+    'code': 'code', 'pre': 'pre',
+    'blockquote': 'blockquote',
+    'tg-spoiler': 'tg-spoiler',
+    'a': 'a',
+}
+# Блочные теги заменяются переводами строк: (до тега, после тега)
+BLOCK_TAGS = {
+    'p': (2, 2), 'div': (1, 1), 'section': (1, 1), 'article': (1, 1),
+    'header': (1, 1), 'footer': (1, 1), 'figure': (1, 1), 'figcaption': (1, 1),
+    'h1': (2, 2), 'h2': (2, 2), 'h3': (2, 2), 'h4': (2, 2), 'h5': (2, 2), 'h6': (2, 2),
+    'ul': (1, 1), 'ol': (1, 1), 'li': (1, 0), 'dl': (1, 1), 'dt': (1, 0), 'dd': (1, 0),
+    'table': (1, 1), 'tr': (1, 0), 'hr': (1, 1), 'br': (0, 0),
+    'blockquote': (1, 1), 'pre': (1, 1),
+}
+# Теги, содержимое которых не показывается вовсе
+SKIP_CONTENT_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'iframe', 'object', 'svg'}
+ALLOWED_URL_SCHEMES = {'http', 'https', 'tg', 'mailto', 'ftp'}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class _TelegramHTMLSanitizer(HTMLParser):
+    """
+    Однопроходный санитайзер: оставляет только поддерживаемые Telegram теги,
+    блочные теги превращает в переводы строк, экранирует текст и закрывает все открытые теги.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        # Открытые разрешенные теги: (имя исходного тега, имя тега Telegram)
+        self._open_tags: List[Tuple[str, str]] = []
+        self._skip_depth = 0
+        self._pending_newlines = 0
+        self._has_text = False
+        self._ends_with_space = True
+
+    # --- Вывод ---
+
+    def _request_newlines(self, count: int):
+        if self._has_text:
+            self._pending_newlines = max(self._pending_newlines, count)
+
+    def _flush_newlines(self):
+        if self._pending_newlines:
+            if self._parts and self._parts[-1].endswith(' '):
+                self._parts[-1] = self._parts[-1].rstrip(' ')
+            self._parts.append('\n' * self._pending_newlines)
+            self._pending_newlines = 0
+            self._ends_with_space = True
+
+    def _is_inside(self, telegram_tag: str) -> bool:
+        return any(open_tag == telegram_tag for _, open_tag in self._open_tags)
+
+    # --- Обработчики HTMLParser ---
+
+    def handle_starttag(self, tag: str, attrs):
+        if tag in SKIP_CONTENT_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag == 'br':
+            # Несколько <br> подряд дают пустую строку, но не больше одной
+            if self._has_text:
+                self._pending_newlines = min(self._pending_newlines + 1, 2)
+        elif tag in BLOCK_TAGS:
+            self._request_newlines(BLOCK_TAGS[tag][0])
+            if tag == 'li':
+                self._flush_newlines()
+                self._parts.append('• ')
+                self._has_text = True
+                self._ends_with_space = True
+        if tag == 'img':
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.handle_data(f' {alt} ')
+            return
+
+        telegram_tag = ALLOWED_TAGS.get(tag)
+        if tag == 'span' and 'tg-spoiler' in (dict(attrs).get('class') or '').split():
+            telegram_tag = 'tg-spoiler'
+        if telegram_tag is None:
+            return
+        # Внутри pre/code Telegram не допускает другую разметку, ссылки не вкладываются друг в друга
+        if self._is_inside('code') or (self._is_inside('pre') and telegram_tag != 'code'):
+            return
+        if telegram_tag == 'a':
+            if self._is_inside('a'):
+                return
+            href = _safe_href(dict(attrs).get('href'))
+            if href is None:
+                return
+            self._flush_newlines()
+            self._parts.append(f'<a href="{html.escape(href, quote=True)}">')
+        else:
+            self._flush_newlines()
+            self._parts.append(f'<{telegram_tag}>')
+        self._open_tags.append((tag, telegram_tag))
+
+    def handle_startendtag(self, tag: str, attrs):
+        # <br/>, <img/> и т.п. - открывающий тег без содержимого
+        if tag in SKIP_CONTENT_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+        if tag in SKIP_CONTENT_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+            return
+        if self._skip_depth:
+            return
+        # Закрываем тег и все незакрытые внутри него; закрывающий тег без открывающего игнорируется
+        for position in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[position][0] == tag:
+                while len(self._open_tags) > position:
+                    _, telegram_tag = self._open_tags.pop()
+                    self._parts.append(f'</{telegram_tag}>')
+                break
+        if tag in BLOCK_TAGS:
+            self._request_newlines(BLOCK_TAGS[tag][1])
+
+    def handle_data(self, data: str):
+        if self._skip_depth or not data:
+            return
+        if not self._is_inside('pre'):
+            data = _WHITESPACE_RE.sub(' ', data)
+            if self._ends_with_space or self._pending_newlines:
+                data = data.lstrip(' ')
+            if not data:
+                return
+        self._flush_newlines()
+        self._parts.append(html.escape(data, quote=False))
+        self._has_text = True
+        self._ends_with_space = data.endswith((' ', '\n'))
+
+    # --- Результат ---
+
+    def result(self) -> str:
+        self.close()
+        while self._open_tags:
+            _, telegram_tag = self._open_tags.pop()
+            self._parts.append(f'</{telegram_tag}>')
+        return ''.join(self._parts).strip()
+
+
+def _safe_href(href: Optional[str]) -> Optional[str]:
+    """Возвращает href, если Telegram примет такую ссылку, иначе None (ссылка превращается в текст)."""
+    if not href:
+        return None
+    href = href.strip()
+    try:
+        scheme = urlsplit(href).scheme.lower()
+    except ValueError:
+        return None
+    return href if scheme in ALLOWED_URL_SCHEMES else None
+
+
+def sanitize_html(text: Optional[str]) -> str:
+    """
+    Приводит HTML из ленты к подмножеству, которое принимает Telegram (parse_mode=HTML).
+    Неподдерживаемые теги удаляются с сохранением текста, блочные теги заменяются переводами строк,
+    содержимое script/style отбрасывается, результат всегда сбалансирован.
+    """
+    if not text:
+        return ''
+    sanitizer = _TelegramHTMLSanitizer()
+    sanitizer.feed(text)
+    return sanitizer.result()
+
+
+# --- Длина сообщения и разбиение ---
+
+# Лимит Telegram на длину текста сообщения (в UTF-16 code units после разбора разметки)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Тег целиком или кусок текста между тегами (одиночный '<' без '>' считается текстом)
+_TOKEN_RE = re.compile(r'<[^>]*>|[^<]+|<')
+_TAG_NAME_RE = re.compile(r'</?\s*([a-zA-Z0-9-]+)')
+
+
+def utf16_length(text: str) -> int:
+    """Длина строки в UTF-16 code units - так Telegram считает длину текста."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _cut_utf16(text: str, limit: int) -> str:
+    """Возвращает самое длинное начало text длиной не более limit UTF-16 code units, не разрывая суррогатные пары."""
+    encoded = text.encode('utf-16-le')[:limit * 2]
+    return encoded.decode('utf-16-le', errors='ignore')
+
+
+def iter_html_parts(html_text: str, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """
+    Разбивает HTML сообщения (уже санитизированный) на части, видимый текст каждой из которых
+    не длиннее limit UTF-16 code units. Длина считается после разбора тегов и сущностей,
+    текст режется по пробелу, если возможно, а открытые на месте разреза теги закрываются
+    и открываются заново в следующей части. Части отдаются лениво.
+    """
+    open_tags: List[Tuple[str, str]] = []
+    parts: List[str] = []
+    length = 0
+    parts_count = 0
+
+    def finish_part() -> str:
+        closing = ''.join(f'</{name}>' for name, _ in reversed(open_tags))
+        return ''.join(parts).rstrip() + closing
+
+    for match in _TOKEN_RE.finditer(html_text):
+        token = match.group()
+        if token.startswith('<') and token.endswith('>') and len(token) > 1:
+            name_match = _TAG_NAME_RE.match(token)
+            if name_match:
+                name = name_match.group(1).lower()
+                if token.startswith('</'):
+                    for position in range(len(open_tags) - 1, -1, -1):
+                        if open_tags[position][0] == name:
+                            del open_tags[position]
+                            break
+                elif not token.endswith('/>'):
+                    open_tags.append((name, token))
+            parts.append(token)
+            continue
+
+        text = html.unescape(token)
+        while text:
+            text_length = utf16_length(text)
+            if length + text_length <= limit:
+                parts.append(html.escape(text, quote=False))
+                length += text_length
+                break
+            piece = _cut_utf16(text, limit - length) or (text[:1] if length == 0 else '')
+            # Режем по последнему пробелу или переносим слово в следующую часть целиком,
+            # но только если текущая часть остается заполненной хотя бы наполовину
+            if not text[len(piece)].isspace():
+                space_position = max(piece.rfind(' '), piece.rfind('\n'))
+                if space_position > 0 and length + utf16_length(piece[:space_position]) >= limit // 2:
+                    piece = piece[:space_position]
+                elif length > 0 and length >= limit // 2:
+                    piece = ''
+            if piece:
+                parts.append(html.escape(piece, quote=False))
+            text = text[len(piece):].lstrip()
+            yield finish_part()
+            parts_count += 1
+            parts = [raw_tag for _, raw_tag in open_tags]
+            length = 0
+
+    if length > 0 or parts_count == 0:
+        yield finish_part()
+
+
+def truncate_html(html_text: str, limit: int = TELEGRAM_MESSAGE_LIMIT, suffix: str = '...') -> str:
+    """
+    Обрезает HTML сообщения до limit UTF-16 code units видимого текста (включая suffix),
+    закрывая открытые на месте обрезки теги.
+    """
+    parts = iter_html_parts(html_text, limit - utf16_length(suffix))
+    first_part = next(parts, '')
+    if next(parts, None) is None:
+        return first_part
+    return first_part + suffix